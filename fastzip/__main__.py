@@ -1,22 +1,45 @@
+import collections
+import functools
+import io
 import logging
 import os
-import zlib
+import sys
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
-from typing import Any, IO, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
 import click
 from keke import kev, TraceOutput
 
+from fastzip import _crc32
 from fastzip.algo import find_compressor_cls
 from fastzip.algo._base import BaseCompressor
 from fastzip.chooser import CompressionChooser
 from fastzip.read import RZipStream
+from fastzip.types import LocalFileHeader
+from fastzip.util import _preadn
 from fastzip.write import DEFAULT_FILE_BUDGET, DEFAULT_IO_THREADS, WZip
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 # TODO this should go in some central place, but also be able to register other
 # (de)compressors like you can with a CompressionChooser rules.
+@functools.lru_cache(maxsize=None)
 def compressor_from_method(method: int) -> BaseCompressor:
     if method == 0:
         return find_compressor_cls("store")[0](1)
@@ -26,41 +49,199 @@ def compressor_from_method(method: int) -> BaseCompressor:
         raise ValueError(method)
 
 
-def verify(filename: str) -> int:
+def _write_stored(
+    src_fd: Optional[int], offset: int, dst: IO[bytes], data: bytes
+) -> None:
+    """
+    Writes `data`, which was read from `src_fd` at `offset`, to `dst`.
+
+    Where possible this uses copy_file_range so the kernel copies (or reflinks)
+    the bytes directly, rather than us writing them back out from userspace.
+    This doesn't use or move the position of `src_fd`, so it's safe to call
+    from several threads.
+    """
+    done = 0
+    if src_fd is not None and hasattr(os, "copy_file_range"):
+        try:
+            dst_fd = dst.fileno()
+            while done < len(data):
+                n = os.copy_file_range(src_fd, dst_fd, len(data) - done, offset + done)
+                if n == 0:
+                    break
+                done += n
+        except OSError:
+            # Includes io.UnsupportedOperation for things without a fileno, and
+            # filesystems that don't support it (EXDEV, EINVAL, ENOSYS...)
+            pass
+    if done < len(data):
+        dst.write(memoryview(data)[done:])
+
+
+def _ordered_map(
+    pool: Executor,
+    func: Callable[..., T],
+    items: Iterable[Tuple[Any, ...]],
+    window: int,
+) -> Iterator[T]:
+    """
+    Like `pool.map(func, *zip(*items))`, but only keeps `window` calls in flight
+    so we don't read the whole archive into memory ahead of the workers.
+
+    Work is submitted in archive order on purpose: sorting it (say by method
+    or size) would mean reading every entry before starting any, and there's
+    no per-method state to reuse -- decompressobjs aren't pooled (see
+    `DeflateCompressor.decompress_iter`) and nothing here combines crcs.
+    """
+    pending: Deque[Future[T]] = collections.deque()
+    for args in items:
+        pending.append(pool.submit(func, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+@contextmanager
+def _buffered_stdout() -> Iterator[IO[str]]:
+    """
+    Yields a text stream over stdout that's only flushed at the end.
+
+    A terminal makes stdout line-buffered, which is a write syscall per entry;
+    that adds up on archives with hundreds of thousands of them.
+    """
+    try:
+        raw = sys.stdout.buffer
+    except AttributeError:
+        # Replaced by something without one (e.g. under a test runner)
+        yield sys.stdout
+        return
+
+    sys.stdout.flush()
+    out = io.TextIOWrapper(
+        io.BufferedWriter(raw, 65536),
+        encoding=sys.stdout.encoding,
+        errors=sys.stdout.errors,
+    )
+    try:
+        yield out
+    finally:
+        out.flush()
+        # Detach both wrappers, otherwise closing them (even via gc) would close
+        # the real stdout.
+        out.detach().detach()
+
+
+def _check_entry(
+    lfh: LocalFileHeader, data: bytes
+) -> Tuple[LocalFileHeader, bytes, int]:
+    obj = compressor_from_method(lfh.method)
+    crc32 = _crc32.crc32
+    crc = 0
+    for chunk in obj.decompress_iter(data):
+        crc = crc32(chunk, crc)
+    return lfh, data, crc
+
+
+def verify(filename: str, threads: Optional[int] = None) -> int:
     z = RZipStream(Path(filename))
+    verbose = log.isEnabledFor(logging.INFO)
+    threads = threads or os.cpu_count() or 1
 
     rc = 0
-    for lfh, header_data, data in z.entries():
-        obj = compressor_from_method(lfh.method)
-        crc = zlib.crc32(obj._decompress_for_testing(data))
-        if lfh.crc32 != crc:
-            print("  %s: %08x != %08x (%d)" % (lfh.filename, crc, lfh.crc32, len(data)))
-            rc |= 1
-        else:
-            print("  %s: ok" % (lfh.filename,))
+    # zlib releases the GIL while decompressing and crcing, so entries can be
+    # checked in parallel; results still come back in archive order.
+    with _buffered_stdout() as out, ThreadPoolExecutor(
+        threads, thread_name_prefix="Decompress"
+    ) as pool:
+        items = ((lfh, data) for lfh, header_data, data in z.entries())
+        for lfh, data, crc in _ordered_map(
+            pool, _check_entry, items, window=threads * 4
+        ):
+            if lfh.crc32 != crc:
+                out.write(
+                    "  %s: %08x != %08x (%d)\n"
+                    % (lfh.filename, crc, lfh.crc32, len(data))
+                )
+                rc |= 1
+            elif verbose:
+                out.write("  %s: ok\n" % (lfh.filename,))
 
     return rc
 
 
-def extract(filename: str, target_dir: str) -> int:
+def _extract_entry(
+    lfh: LocalFileHeader,
+    data: bytes,
+    path: Path,
+    src_fd: Optional[int],
+    offset: int,
+) -> Tuple[LocalFileHeader, bytes, int]:
+    obj = compressor_from_method(lfh.method)
+    with path.open("wb") as f:
+        if obj.number == 0:
+            crc = _crc32.crc32(data)
+            _write_stored(src_fd, offset, f, data)
+        else:
+            # Bound to locals since this runs once per (1MiB) chunk.  Chunks
+            # that size already bypass the BufferedWriter's buffer, so there's
+            # no extra copy to avoid with buffering=0.
+            crc32 = _crc32.crc32
+            write = f.write
+            crc = 0
+            for chunk in obj.decompress_iter(data):
+                crc = crc32(chunk, crc)
+                write(chunk)
+    return lfh, data, crc
+
+
+def extract(filename: str, target_dir: str, threads: Optional[int] = None) -> int:
     z = RZipStream(Path(filename))
     target_path = Path(target_dir)
+    threads = threads or os.cpu_count() or 1
+    try:
+        src_fd: Optional[int] = z.fileno() if hasattr(os, "pread") else None
+    except (AttributeError, io.UnsupportedOperation):
+        src_fd = None
 
-    rc = 0
-    for lfh, header_data, data in z.entries():
-        obj = compressor_from_method(lfh.method)
-        decompressed = obj._decompress_for_testing(data)
-        crc = zlib.crc32(decompressed)
-        if lfh.crc32 != crc:
-            print("  %s: %08x != %08x (%d)" % (lfh.filename, crc, lfh.crc32, len(data)))
-            rc |= 1
-
-        assert lfh.filename is not None
-        if lfh.filename.endswith("/"):
-            (target_path / lfh.filename).mkdir(parents=True, exist_ok=True)
+    def entries() -> Iterator[Tuple[LocalFileHeader, bytes, int]]:
+        # With an fd, the offsets let stored entries be copied by the kernel
+        if src_fd is None:
+            for lfh, header_data, data in z.entries():
+                yield lfh, data, 0  # offset is unused without src_fd
         else:
-            (target_path / lfh.filename).parent.mkdir(parents=True, exist_ok=True)
-        (target_path / lfh.filename).write_bytes(decompressed)
+            for lfh, header_data, offset in z.entry_offsets():
+                yield lfh, _preadn(src_fd, lfh.csize, offset), offset
+
+    def items() -> Iterator[Tuple[Any, ...]]:
+        # Directories are all created here on the main thread, so the workers
+        # only ever open files.
+        made: Set[Path] = set()
+        for lfh, data, offset in entries():
+            assert lfh.filename is not None
+            path = target_path / lfh.filename
+            if lfh.filename.endswith("/"):
+                path.mkdir(parents=True, exist_ok=True)
+                made.add(path)
+                continue
+
+            if path.parent not in made:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                made.add(path.parent)
+            yield lfh, data, path, src_fd, offset
+
+    rc = 0
+    with _buffered_stdout() as out, ThreadPoolExecutor(
+        threads, thread_name_prefix="Decompress"
+    ) as pool:
+        for lfh, data, crc in _ordered_map(
+            pool, _extract_entry, items(), window=threads * 4
+        ):
+            if lfh.crc32 != crc:
+                out.write(
+                    "  %s: %08x != %08x (%d)\n"
+                    % (lfh.filename, crc, lfh.crc32, len(data))
+                )
+                rc |= 1
 
     return rc
 
@@ -69,18 +250,29 @@ def compress(
     filename: str, members: List[str], force_method: Optional[str] = None, **kwargs: Any
 ) -> int:
     rc = 0
-    with WZip(Path(filename), **kwargs) as z:
-        if force_method:
-            z._chooser = CompressionChooser(default=force_method)
+    if force_method:
+        # Validated (and the class looked up) once, here, rather than swapped in
+        # after the consumer threads have started.
+        kwargs["chooser"] = CompressionChooser(default=force_method)
 
+    # Merged zips are closed only after the WZip has finished with them; the IO
+    # threads may still be reading their fds well after we've moved on.
+    with ExitStack() as merged, WZip(Path(filename), **kwargs) as z:
         for m in members:
             try:
                 if m.startswith("+"):
                     # Merge in another zip
                     with kev("+merge"):
-                        zi = RZipStream(Path(m[1:]))
-                        for lfh, header_data, data in zi.entries():
-                            z.enqueue_precompressed(lfh, b"", data)
+                        zi = merged.enter_context(RZipStream(Path(m[1:])))
+                        if hasattr(os, "pread"):
+                            # The IO threads read the data while we parse the
+                            # next header
+                            fd = zi.fileno()
+                            for lfh, header_data, offset in zi.entry_offsets():
+                                z.enqueue_precompressed_at(lfh, fd, offset)
+                        else:
+                            for lfh, header_data, data in zi.entries():
+                                z.enqueue_precompressed(lfh, b"", data)
                 else:
                     z.rwrite(Path(m))
 
@@ -104,7 +296,7 @@ def compress(
 )
 @click.option(
     "--threads",
-    help="Number of compression threads",
+    help="Number of (de)compression threads",
     default=os.cpu_count(),
     show_default=True,
 )
@@ -149,17 +341,18 @@ def main(
 
     # Note that thread_sortkeys is kind of best-effort; trace viewers may not support it.
     with TraceOutput(
-        file=trace, thread_sortkeys={"MainThread": -1, "Compress": 2, "IO": 3}
+        file=trace,
+        thread_sortkeys={"MainThread": -1, "Compress": 2, "Decompress": 2, "IO": 3},
     ):
         if verb == "test":
             assert len(files) == 1
             with kev("test", __name__):
-                return verify(files[0])
+                return verify(files[0], threads)
         elif verb == "extract":
             assert len(files) == 1
             assert dest is not None
             with kev("extract", __name__):
-                return extract(files[0], dest)
+                return extract(files[0], dest, threads)
         elif verb == "compress":
             assert output is not None
 
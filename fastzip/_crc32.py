@@ -0,0 +1,22 @@
+"""
+The fastest available `crc32(data, value=0)`.
+
+Every byte we write gets crc'd, and unless it was built with a SIMD crc32 (most
+distro and python.org builds aren't) the stdlib's runs at a few GB/s.  zlib-ng
+and libdeflate both use pclmulqdq/pmull where available and are an order of
+magnitude faster; crc32 is standardized, so the results are identical and
+unlike the deflate backend there's no reason not to use them when installed.
+
+All three release the GIL while crcing large buffers (the stdlib above 5KiB),
+which the compress threads rely on to crc in parallel.
+"""
+
+try:
+    from zlib_ng.zlib_ng import crc32
+except ImportError:
+    try:
+        from deflate import crc32
+    except ImportError:
+        from zlib import crc32
+
+__all__ = ["crc32"]
@@ -1,16 +1,231 @@
-from ctypes import c_ulong, CDLL
+from ctypes import c_int64, c_long, c_uint32, c_ulong, CDLL
 from ctypes.util import find_library
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
-# TODO I suspect this needs to be different on Windows
-_zlib_ctypes = CDLL(find_library("z"))
-_zlib_ctypes.crc32_combine.argtypes = [c_ulong, c_ulong, c_ulong]
-_zlib_ctypes.crc32_combine.restype = c_ulong
+# The reflected CRC-32 polynomial used by zip (and zlib).  In this bit order x^0
+# is the high bit, so "1" is `1 << 31` and "x" is `1 << 30`.
+_POLY = 0xEDB88320
 
 
-def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+def _multmodp(a: int, b: int) -> int:
     """
-    This function is a trivial wrapper around ctypes for the benefit of typing.
+    Returns `a * b mod P` in GF(2)[x], where both are reflected 32-bit values.
 
-    More explanation at https://groups.google.com/g/comp.compression/c/SHyr5bp5rtc/m/PP5-pmv9-9sJ
+    This is the same formulation that zlib >= 1.2.12 uses; it exits early once
+    there are no more bits set in `a`.  `a` must be nonzero, which holds for all
+    the powers of x we call this with.
     """
-    return _zlib_ctypes.crc32_combine(crc1, crc2, len2)  # type: ignore
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ _POLY if b & 1 else b >> 1
+    return p
+
+
+def _make_x2n_table() -> List[int]:
+    # _X2N_TABLE[k] is x^(2^k) mod P
+    table = [1 << 30]
+    for _ in range(31):
+        table.append(_multmodp(table[-1], table[-1]))
+    return table
+
+
+_X2N_TABLE = _make_x2n_table()
+
+
+def _x2nmodp(n: int, k: int) -> int:
+    """
+    Returns `x^(n * 2^k) mod P` by multiplying together the relevant table
+    entries, one per set bit of n.
+    """
+    p = 1 << 31  # x^0
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N_TABLE[k & 31], p)
+        n >>= 1
+        k += 1
+    return p
+
+
+def _crc32_combine_gen_pure(len2: int) -> int:
+    return _x2nmodp(len2, 3)
+
+
+def _crc32_combine_op_pure(crc1: int, crc2: int, op: int) -> int:
+    return _multmodp(op, crc1) ^ crc2
+
+
+def _crc32_combine_pure(crc1: int, crc2: int, len2: int) -> int:
+    """
+    Pure-python fallback for when we can't find a libz to call into.
+    """
+    return _multmodp(_x2nmodp(len2, 3), crc1) ^ crc2
+
+
+# In order of preference.  zlib-ng's native build prefixes its symbols with
+# `zng_`, and the `64` variant takes a 64-bit length even where `long` is 32 bits
+# (notably on Windows, where the dll also has a different name).
+_CANDIDATES: List[Tuple[str, str, Any, Any]] = [
+    ("z-ng", "zng_crc32_combine", c_uint32, c_int64),
+    ("z", "crc32_combine64", c_ulong, c_int64),
+    ("z", "crc32_combine", c_ulong, c_long),
+    ("zlib", "crc32_combine64", c_ulong, c_int64),
+    ("zlib1", "crc32_combine64", c_ulong, c_int64),
+]
+
+
+def _load_crc32_combine() -> Optional[Callable[[int, int, int], int]]:
+    for libname, funcname, crc_type, len_type in _CANDIDATES:
+        path = find_library(libname)
+        if path is None:
+            continue
+        try:
+            func = getattr(CDLL(path), funcname)
+        except (OSError, AttributeError):
+            continue
+        func.argtypes = [crc_type, crc_type, len_type]
+        func.restype = crc_type
+        return func  # type: ignore[no-any-return]
+    return None
+
+
+_zlib_crc32_combine = _load_crc32_combine()
+
+if _zlib_crc32_combine is None:
+
+    def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+        """
+        This function calls `_crc32_combine_pure` because libz was unavailable.
+
+        More explanation at https://groups.google.com/g/comp.compression/c/SHyr5bp5rtc/m/PP5-pmv9-9sJ
+        """
+        return _crc32_combine_pure(crc1, crc2, len2)
+
+else:
+
+    def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+        """
+        This function is a trivial wrapper around ctypes for the benefit of typing.
+
+        More explanation at https://groups.google.com/g/comp.compression/c/SHyr5bp5rtc/m/PP5-pmv9-9sJ
+        """
+        return _zlib_crc32_combine(crc1, crc2, len2)  # type: ignore
+
+
+# zlib >= 1.2.12 can also split the work up like our pure functions do.  Same
+# order of preference as above.
+_GEN_OP_CANDIDATES: List[Tuple[str, str, str, Any]] = [
+    ("z-ng", "zng_crc32_combine_gen64", "zng_crc32_combine_op", c_uint32),
+    ("z", "crc32_combine_gen64", "crc32_combine_op", c_ulong),
+    ("zlib", "crc32_combine_gen64", "crc32_combine_op", c_ulong),
+    ("zlib1", "crc32_combine_gen64", "crc32_combine_op", c_ulong),
+]
+
+
+def _load_crc32_combine_gen_op() -> Tuple[
+    Optional[Callable[[int], int]], Optional[Callable[[int, int, int], int]]
+]:
+    for libname, gen_name, op_name, crc_type in _GEN_OP_CANDIDATES:
+        path = find_library(libname)
+        if path is None:
+            continue
+        try:
+            lib = CDLL(path)
+            gen = getattr(lib, gen_name)
+            op = getattr(lib, op_name)
+        except (OSError, AttributeError):
+            continue
+        gen.argtypes = [c_int64]
+        gen.restype = crc_type
+        op.argtypes = [crc_type, crc_type, crc_type]
+        op.restype = crc_type
+        return gen, op
+    return None, None
+
+
+_zlib_crc32_combine_gen, _zlib_crc32_combine_op = _load_crc32_combine_gen_op()
+
+if _zlib_crc32_combine_gen is None or _zlib_crc32_combine_op is None:
+
+    def crc32_combine_gen(len2: int) -> int:
+        """
+        Returns an operator for `crc32_combine_op` that appends `len2` bytes.
+
+        When combining many chunks of the same length (which is what the
+        parallel compressors produce) generating this once avoids redoing the
+        O(log len2) work on every combine.
+        """
+        return _crc32_combine_gen_pure(len2)
+
+    def crc32_combine_op(crc1: int, crc2: int, op: int) -> int:
+        """
+        Like `crc32_combine` but using a precomputed `op` from
+        `crc32_combine_gen`.
+        """
+        return _crc32_combine_op_pure(crc1, crc2, op)
+
+else:
+
+    def crc32_combine_gen(len2: int) -> int:
+        """
+        Returns an operator for `crc32_combine_op` that appends `len2` bytes.
+
+        This is a trivial wrapper around ctypes for the benefit of typing.
+        """
+        return _zlib_crc32_combine_gen(len2)  # type: ignore
+
+    def crc32_combine_op(crc1: int, crc2: int, op: int) -> int:
+        """
+        Like `crc32_combine` but using a precomputed `op` from
+        `crc32_combine_gen`.
+
+        This is a trivial wrapper around ctypes for the benefit of typing.
+        """
+        return _zlib_crc32_combine_op(crc1, crc2, op)  # type: ignore
+
+
+def crc32_combine_many(pairs: Iterable[Tuple[int, int]]) -> int:
+    """
+    Given `(crc, length)` for consecutive chunks, returns the crc of their
+    concatenation.
+
+    The parallel compressors produce chunks that are nearly all the same
+    length, so this only generates one operator per distinct length rather than
+    one per combine.  With an older libz that lacks the gen/op functions a
+    single combine call is cheaper than applying a python-computed operator, so
+    we just fold.
+    """
+    crc = 0  # crc32(b"")
+    # Everything called in the loops is bound to a local, to skip the global
+    # lookups (and for libz, our wrapper's extra frame) on each iteration.
+    gen: Optional[Callable[[int], int]] = _zlib_crc32_combine_gen
+    apply_op = _zlib_crc32_combine_op
+    combine = _zlib_crc32_combine
+    if combine is None:
+        ops: Dict[int, int] = {}
+        get_op = ops.get
+        gen = _crc32_combine_gen_pure
+        multmodp = _multmodp
+        for crc2, len2 in pairs:
+            op = get_op(len2)
+            if op is None:
+                op = ops[len2] = gen(len2)
+            crc = multmodp(op, crc) ^ crc2
+    elif gen is not None and apply_op is not None:
+        # zlib >= 1.2.12: same caching, but each op is O(1) in C
+        ops = {}
+        get_op = ops.get
+        for crc2, len2 in pairs:
+            op = get_op(len2)
+            if op is None:
+                op = ops[len2] = gen(len2)
+            crc = apply_op(crc, crc2, op)
+    else:
+        for crc2, len2 in pairs:
+            crc = combine(crc, crc2, len2)
+    return crc
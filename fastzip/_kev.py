@@ -0,0 +1,28 @@
+"""
+A cheaper `keke.kev` for when nothing is tracing.
+
+keke's `kev` is a generator-based context manager, so even with no tracer it
+costs ~1.3us to enter and exit.  There are several of these per file (and per
+block), which for many small files adds up to a noticeable fraction of the
+per-file work.  This checks for a tracer first and otherwise hands back a
+shared no-op context manager.
+
+The check happens on every call rather than at import, so `--trace` (which
+installs the tracer at runtime) still sees everything.
+"""
+
+from contextlib import nullcontext
+from typing import Any, ContextManager
+
+import keke
+
+_NULL: ContextManager[None] = nullcontext()
+
+
+def kev(name: str, cat: str = "dur", **kwargs: Any) -> ContextManager[None]:
+    if keke.get_tracer() is None:
+        return _NULL
+    return keke.kev(name, cat, **kwargs)  # type: ignore[no-any-return]
+
+
+__all__ = ["kev"]
@@ -1,9 +1,20 @@
+import functools
 import importlib
-from typing import Tuple, Type
+from typing import Dict, Tuple, Type
 
 from ._base import BaseCompressor
+from .deflate import DeflateCompressor
+from .store import StoreCompressor
 
+# These only need the stdlib, so are imported up front; zstd stays lazy because
+# it's an optional dependency.
+_BUILTINS: Dict[str, Type[BaseCompressor]] = {
+    "store": StoreCompressor,
+    "deflate": DeflateCompressor,
+}
 
+
+@functools.lru_cache(maxsize=None)
 def find_compressor_cls(d: str) -> Tuple[Type[BaseCompressor], str]:
     """
     Returns (compressor_class, param_str)
@@ -12,9 +23,13 @@ def find_compressor_cls(d: str) -> Tuple[Type[BaseCompressor], str]:
     those strings, but any other must be provided as "qual.name:ClsName"
     format.
 
-    Can raise ImportError, AttributeError, etc.
+    Can raise ImportError, AttributeError, etc.  Successful lookups are cached,
+    so repeated calls with the same string are just a dict lookup.
     """
     compname, _, params = d.partition("@")
+    cls = _BUILTINS.get(compname)
+    if cls is not None:
+        return cls, params
     if ":" in compname:
         modname, _, compname = compname.partition(":")
     else:
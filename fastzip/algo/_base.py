@@ -1,8 +1,43 @@
 from __future__ import annotations
 
+import functools
+import sys
 from concurrent.futures import Executor, Future
 
-from typing import Dict, Optional, Sequence, Tuple, Union
+from typing import Dict, Iterator, NamedTuple, Optional, Sequence, Tuple, TypeVar, Union
+
+# Decompressed data is handed out in pieces this big.  Each piece costs a few
+# python-level calls (decompress, crc32, write), so this wants to be large enough
+# for those to be noise next to the time spent in C; zlib's crc32 is fastest on
+# big buffers anyway.
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# Below this size, work that's only a crc32 is cheaper to do inline than to hand
+# to the pool (submitting and later collecting a future is tens of us).
+SYNC_THRESHOLD = 16 * 1024
+
+T = TypeVar("T")
+
+
+class CompressedChunk(NamedTuple):
+    """
+    What each of a compressor's futures produce.  `data` is concatenated as-is;
+    `crc32` (when not None) covers `raw_length` bytes of input and gets merged
+    with its neighbors by the consumer.
+    """
+
+    data: Union[bytes, memoryview]
+    raw_length: int
+    crc32: Optional[int]
+
+
+def completed_future(result: T) -> Future[T]:
+    """
+    Returns a Future that already has `result`, for work done synchronously.
+    """
+    f: Future[T] = Future()
+    f.set_result(result)
+    return f
 
 
 class BaseCompressor:
@@ -18,12 +53,19 @@ class BaseCompressor:
         """
         self._threads = threads
 
+    def prepare(self) -> None:
+        """
+        Does any setup for compressing that can fail (e.g. importing an
+        optional library), so the writer can surface that up front rather than
+        on one of its threads.  Decompressing shouldn't need this.
+        """
+
     def compress_to_futures(
         self,
         pool: Executor,
         size: int,
         mmap_future: Union[memoryview, Future[memoryview]],
-    ) -> Sequence[Future[Tuple[bytes, int, Optional[int]]]]:
+    ) -> Sequence[Future[CompressedChunk]]:
         """
         Compress the given data, presumably in parallel.
 
@@ -31,9 +73,17 @@ class BaseCompressor:
         concurrently as well.  Use a mutex here or in whatever the returned
         future runs to ensure this.
 
-        The returned futures are (compressed_chunk, raw_length,
-        [raw_chunk_crc32]).  The consumer of these needs to merge crc32s but can
-        just concatenate compressed_chunk.
+        The returned futures are `CompressedChunk(data, raw_length, crc32)`.
+        The consumer of these needs to merge crc32s but can just concatenate
+        data.
+        """
+        raise NotImplementedError
+
+    def decompress_iter(self, data: bytes) -> Iterator[Union[bytes, memoryview]]:
+        """
+        Decompress the given data, yielding pieces of roughly
+        `DECOMPRESS_CHUNK_SIZE` so the caller never needs to hold the whole
+        output.
         """
         raise NotImplementedError
 
@@ -41,22 +91,31 @@ class BaseCompressor:
         """
         Only intended for testing, this buffers the entire input and output.
         """
-        raise NotImplementedError
+        return b"".join(self.decompress_iter(data))
 
 
 def parse_params(params: str) -> Dict[str, int]:
     """
     Parses a dict of `,` and `=` separated parameters.
+
+    The result is a new dict each time, so callers are free to modify it.
     """
-    d: Dict[str, int] = {}
+    return dict(_parse_params(params))
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_params(params: str) -> Tuple[Tuple[str, int], ...]:
+    # There are only ever a handful of distinct params strings (one per chooser
+    # rule), but they're parsed for every compressor instantiated.
     if not params:
-        return d
+        return ()
 
+    items = []
     for p in params.split(","):
         k, _, v = p.partition("=")
         if v:
             vi = int(v)
         else:
             vi = 1
-        d[k] = vi
-    return d
+        items.append((sys.intern(k), vi))
+    return tuple(items)
@@ -1,13 +1,15 @@
 from threading import Lock
 
-from typing import Callable, Generic, List, TypeVar
+from typing import Callable, Generic, List, Optional, TypeVar
 
 T = TypeVar("T")
 
 
 class FactoryFreelist(Generic[T]):
-    def __init__(self, factory_func: Callable[[], T]):
+    def __init__(self, factory_func: Callable[[], T], max_size: Optional[int] = None):
         self.factory_func = factory_func
+        # Objects left beyond this many are dropped rather than kept
+        self.max_size = max_size
         self.freelist: List[T] = []
         self.lock = Lock()
 
@@ -20,4 +22,5 @@ class FactoryFreelist(Generic[T]):
 
     def leave(self, obj: T) -> None:
         with self.lock:
-            self.freelist.append(obj)
+            if self.max_size is None or len(self.freelist) < self.max_size:
+                self.freelist.append(obj)
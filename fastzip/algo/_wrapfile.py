@@ -1,14 +1,45 @@
 from __future__ import annotations
 
+import functools
 import io
+import logging
 import mmap
 import os
 import time
 from concurrent.futures import Future
 from threading import Lock
-from typing import Any, IO, Optional, Tuple, Union
+from typing import Any, Dict, IO, Optional, Tuple, Union
 
-from keke import kev
+from .._kev import kev
+
+from ._freelist import FactoryFreelist
+
+LOG = logging.getLogger(__name__)
+
+# Files up to this size are read into a pooled buffer instead of being mmapped;
+# for small files the mmap setup and teardown costs more than the copy.
+READ_THRESHOLD = 1024 * 1024
+
+# How much of a mmapped file to ask the kernel to read ahead up front (and if
+# the whole file fits, to prefault).
+WILLNEED_LENGTH = 64 * 1024 * 1024
+
+# Pooled buffers come in power-of-two sizes so that a small file only pins a
+# small buffer.  These are process-wide, so each size keeps at most this many
+# bytes' worth between files; past that they're freed (and allocated again on
+# demand) instead of staying around after the writer is done.
+POOLED_BYTES_PER_SIZE = 4 * 1024 * 1024
+_BUFFER_FREELISTS: Dict[int, FactoryFreelist[bytearray]] = {
+    1
+    << n: FactoryFreelist(
+        functools.partial(bytearray, 1 << n), POOLED_BYTES_PER_SIZE >> n
+    )
+    for n in range(12, READ_THRESHOLD.bit_length())
+}
+
+
+def _buffer_size(length: int) -> int:
+    return max(1 << (length - 1).bit_length(), 4096)
 
 
 class WrappedFile:
@@ -17,6 +48,7 @@ class WrappedFile:
         self._mmap: Optional[mmap.mmap] = None
         self._stat: Optional[os.stat_result] = None
         self._cached_mmap: Optional[Tuple[int, memoryview]] = None
+        self._buffer: Optional[bytearray] = None
         self._lock = Lock()
 
     def _ensure_future_result(self) -> None:
@@ -25,12 +57,15 @@ class WrappedFile:
                 self.fo = self.fo.result()
 
     def stat(self) -> os.stat_result:
+        # Checked first, before taking the lock in _ensure_future_result; this
+        # is called several times per file.
+        st = self._stat
+        if st is not None:
+            return st
+
         self._ensure_future_result()
         assert not isinstance(self.fo, Future)
 
-        if self._stat is not None:
-            return self._stat
-
         try:
             st = os.fstat(self.fo.fileno())
         except (TypeError, AttributeError, io.UnsupportedOperation):
@@ -88,26 +123,83 @@ class WrappedFile:
                 # We can't make a zero-length mapping on Windows, but it's pretty
                 # useless to make one anywhere.
                 return length, memoryview(b"")
-            elif length <= 32768:
+            elif length <= READ_THRESHOLD:
                 with kev("read", __name__, size=length):
-                    return length, memoryview(self.fo.read(length))
+                    return length, self._read_pooled(fileno, length)
             with kev("mmap", __name__, size=length):
-                self._mmap = mmap.mmap(
-                    fileno, length, mmap.MAP_SHARED, prot=mmap.PROT_READ
-                )
-                return length, memoryview(self._mmap)
+                if hasattr(mmap, "PROT_READ"):
+                    # Read-only and shared, so there's no copy-on-write setup.
+                    flags = mmap.MAP_SHARED
+                    if length <= WILLNEED_LENGTH:
+                        # This runs on an IO thread, so prefault the whole thing
+                        # here rather than having the compress threads take the
+                        # faults.
+                        flags |= getattr(mmap, "MAP_POPULATE", 0)
+                    self._mmap = mmap.mmap(fileno, length, flags, prot=mmap.PROT_READ)
+                else:
+                    # Windows
+                    self._mmap = mmap.mmap(fileno, length, access=mmap.ACCESS_READ)
+            # Compressors read each file front-to-back exactly once, so have the
+            # kernel start readahead now and be aggressive about it.  Only the
+            # start though; for a huge file sequential readahead takes it from
+            # there, without us evicting everything else from the page cache.
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                with kev("madvise", __name__):
+                    self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+                    self._mmap.madvise(
+                        mmap.MADV_WILLNEED, 0, min(length, WILLNEED_LENGTH)
+                    )
+            return length, memoryview(self._mmap)
+
+    def _read_pooled(self, fileno: int, length: int) -> memoryview:
+        """
+        Reads the whole file into a buffer from `_BUFFER_FREELISTS`, which is
+        returned to the pool on `__exit__`; so that mustn't happen until
+        everything reading the returned view is done with it.
+        """
+        assert not isinstance(self.fo, Future)
+        self._buffer = _BUFFER_FREELISTS[_buffer_size(length)].enter()
+        view = memoryview(self._buffer)[:length]
+        pos = 0
+        while pos < length:
+            if hasattr(os, "preadv"):
+                # Doesn't move the file position, so this is safe even if
+                # someone else is reading from fo.
+                n = os.preadv(fileno, [view[pos:]], pos)
+            else:
+                n = self.fo.readinto(view[pos:])  # type: ignore[attr-defined]
+            if not n:
+                # File got shorter since we stat'd it
+                break
+            pos += n
+        return view[:pos]
 
     def __enter__(self) -> "WrappedFile":
         return self
 
     def __exit__(self, *args: Any) -> None:
-        if self._mmap:
-            self._cached_mmap = None
-            self._mmap.close()
-        # XXX this exit being be called in the same executor that the future is
-        # from... hopefully the result is already ready, we just need to fetch
-        # it.
-        if isinstance(self.fo, Future):
-            print("DEADLOCK?")
-        else:
+        try:
+            if self._mmap:
+                self._cached_mmap = None
+                # Unmapping drops the pages from our RSS; they stay in the page
+                # cache.
+                self._mmap.close()
+            if self._buffer is not None:
+                self._cached_mmap = None
+                _BUFFER_FREELISTS[len(self._buffer)].leave(self._buffer)
+                self._buffer = None
+        finally:
+            # Always close, even if the open never got collected; a leaked fd
+            # also leaks its slot in the writer's file budget.
+            fo = self.fo
+            if isinstance(fo, Future):
+                if not fo.done():
+                    # If this is running on the executor that the open is
+                    # queued on, this can deadlock.
+                    LOG.warning("Waiting for open of %r in __exit__", self)
+                if fo.exception() is not None:
+                    # Nothing to close; whoever calls .result() sees the error
+                    return
+                self._ensure_future_result()
+            assert not isinstance(self.fo, Future)
             self.fo.close()
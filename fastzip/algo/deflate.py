@@ -1,14 +1,150 @@
 from __future__ import annotations
 
+import functools
+import logging
+import mmap
+import os
+import subprocess
+import sys
 import zlib
 from concurrent.futures import Executor, Future
-from typing import Optional, Sequence, Tuple, Union
+from threading import Lock
+from typing import Any, Callable, Iterator, Optional, Sequence, Tuple, Union
 
-from keke import kev
+from .._crc32 import crc32
 
-from ._base import BaseCompressor, parse_params
+from .._kev import kev
+from ._base import (
+    BaseCompressor,
+    completed_future,
+    CompressedChunk,
+    DECOMPRESS_CHUNK_SIZE,
+    parse_params,
+)
+from ._freelist import FactoryFreelist
 
-THREAD_BLOCK_SIZE = 1024 * 1024  # 1MiB
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024  # 1MiB
+
+
+def _l2_cache_size() -> Optional[int]:
+    """
+    Returns the size of (cpu0's) L2 cache in bytes, or None if we can't tell.
+    """
+    # Anything we can't parse is treated as unknown; this runs at import.
+    try:
+        with open("/sys/devices/system/cpu/cpu0/cache/index2/size") as f:
+            size = f.read().strip()
+    except OSError:
+        pass
+    else:
+        units = {"K": 1024, "M": 1024 * 1024}
+        try:
+            if size[-1:] in units:
+                return int(size[:-1]) * units[size[-1]]
+            return int(size)
+        except ValueError:
+            return None
+
+    if sys.platform == "darwin":
+        try:
+            out = subprocess.run(
+                ["sysctl", "-n", "hw.l2cachesize"],
+                capture_output=True,
+                check=True,
+            ).stdout
+            return int(out)
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            pass
+    return None
+
+
+def _block_size(setting: str) -> int:
+    """
+    Parses `FASTZIP_BLOCK_SIZE`, which is either a number of bytes or "auto" for
+    half of L2 (the block, its window and hash chains then stay in cache).
+
+    The default doesn't vary by machine, because the block boundaries affect the
+    output (each is a full flush, so it's a few bytes per block either way).
+
+    This runs at import, so a bad value is warned about and ignored rather than
+    keeping even verify and extract from starting.
+    """
+    if not setting:
+        return DEFAULT_BLOCK_SIZE
+    elif setting == "auto":
+        l2 = _l2_cache_size()
+        if l2 is None or l2 <= 0:
+            return DEFAULT_BLOCK_SIZE
+        size = min(max(l2 // 2, 256 * 1024), 8 * 1024 * 1024)
+    else:
+        try:
+            size = int(setting)
+        except ValueError:
+            size = 0
+        if size <= 0:
+            LOG.warning(
+                "Ignoring FASTZIP_BLOCK_SIZE=%r, using %d", setting, DEFAULT_BLOCK_SIZE
+            )
+            return DEFAULT_BLOCK_SIZE
+    # Blocks must start on a page boundary for the madvise in _compress_block.
+    return max(size - size % mmap.PAGESIZE, mmap.PAGESIZE)
+
+
+THREAD_BLOCK_SIZE = _block_size(os.environ.get("FASTZIP_BLOCK_SIZE", ""))
+
+# Which deflate implementation compresses.  These all produce valid (but
+# different) streams, so anything other than the stdlib is opt-in to keep output
+# reproducible from machine to machine.
+#
+#   stock       the stdlib zlib
+#   ng          zlib-ng (`pip install zlib-ng`), a faster drop-in for zlib
+#   libdeflate  libdeflate (`pip install deflate`) for final blocks, which is
+#               most files; it can't do the full flush that non-final blocks
+#               need, so those use zlib-ng if installed, else the stdlib
+DEFLATE_BACKEND = os.environ.get("FASTZIP_DEFLATE_BACKEND", "stock")
+
+OneshotFunc = Callable[[Union[bytes, memoryview], int], bytes]
+
+
+def _raw_deflate(zlib_mod: Any) -> OneshotFunc:
+    """
+    Returns a oneshot function using `zlib_mod.compress`, which writes straight
+    into one output buffer rather than concatenating compress() and flush().
+    """
+
+    def oneshot(data: Union[bytes, memoryview], level: int) -> bytes:
+        return zlib_mod.compress(data, level, -15)  # type: ignore[no-any-return]
+
+    return oneshot
+
+
+@functools.lru_cache(maxsize=None)
+def _load_backend(name: str) -> Tuple[Any, Optional[OneshotFunc]]:
+    """
+    Returns `(zlib_compatible_module, oneshot_func)` for the given backend name,
+    where `oneshot_func(data, level)` (if not None) compresses a final block.
+
+    Can raise ImportError if the backend isn't installed.
+    """
+    if name == "stock":
+        # compress() only takes wbits (for a raw stream) as of 3.11
+        return zlib, _raw_deflate(zlib) if sys.version_info >= (3, 11) else None
+    elif name == "ng":
+        from zlib_ng import zlib_ng
+
+        return zlib_ng, _raw_deflate(zlib_ng)
+    elif name == "libdeflate":
+        import deflate
+
+        try:
+            from zlib_ng import zlib_ng as zlib_mod
+        except ImportError:
+            zlib_mod = zlib
+        return zlib_mod, deflate.deflate_compress
+    else:
+        raise ValueError(f"Unknown FASTZIP_DEFLATE_BACKEND {name!r}")
 
 
 class DeflateCompressor(BaseCompressor):
@@ -28,20 +164,65 @@ class DeflateCompressor(BaseCompressor):
             else:
                 raise ValueError(f"Unknown param {k!r} for {self.__class__.__name__}")
 
+        # The backend is only loaded on the first compress; verify and extract
+        # make instances of this just to decompress, and shouldn't fail over a
+        # FASTZIP_DEFLATE_BACKEND that isn't installed.
+        self._zlib: Any = None
+        self._oneshot: Optional[OneshotFunc] = None
+        self._freelist: Optional[FactoryFreelist[Any]] = None
+        self._empty: Optional[CompressedChunk] = None
+        self._load_lock = Lock()
+
+    def prepare(self) -> None:
+        self._load()
+
+    def _load(self) -> CompressedChunk:
+        """
+        Loads the backend if that hasn't happened yet, and returns the
+        compressed empty file.
+        """
+        # Checked first, before taking the lock; this is called once per file.
+        empty = self._empty
+        if empty is not None:
+            return empty
+        with self._load_lock:
+            if self._empty is None:
+                self._zlib, self._oneshot = _load_backend(DEFLATE_BACKEND)
+                # For non-final blocks only.  A full flush leaves a compressobj
+                # in the same state as a new one (so the output is identical),
+                # and reusing it skips the ~30us deflateInit; a Z_FINISH'd one
+                # can't be reused.
+                self._freelist = FactoryFreelist(
+                    functools.partial(
+                        self._zlib.compressobj, self._compresslevel, zlib.DEFLATED, -15
+                    )
+                )
+                # An empty file always compresses to the same couple of bytes
+                # (for a given level and backend), so do that once.
+                self._empty = self._compress_block(b"", 0, 0, True)
+            return self._empty
+
     def compress_to_futures(
         self,
         pool: Executor,
         size: int,
         mmap_future: Union[memoryview, Future[memoryview]],
-    ) -> Sequence[Future[Tuple[bytes, int, Optional[int]]]]:
-        with kev("block_starts", __name__):
-            if size == 0:
-                block_starts = [0]
-            else:
-                block_starts = list(range(0, size, THREAD_BLOCK_SIZE))
+    ) -> Sequence[Future[CompressedChunk]]:
+        empty = self._load()
+        if size == 0:
+            return [completed_future(empty)]
+
+        # A range rather than a list, so this doesn't allocate an int per block
+        # of a huge file.
+        block_starts = range(0, size, THREAD_BLOCK_SIZE)
+        last_start = block_starts[-1]
 
         # DEFLATE streams can be concatenated, as long as a Z_FINISH block is
         # not issued too early.
+        #
+        # Each block gets the whole (future) view plus its bounds, and slices it
+        # in the worker; that way the view doesn't have to be resolved here, and
+        # no per-block memoryviews exist until a worker is running.
 
         with kev("pool.submit", __name__):
             return [
@@ -51,7 +232,7 @@ class DeflateCompressor(BaseCompressor):
                     mmap_future,
                     start,
                     min(size, start + THREAD_BLOCK_SIZE),
-                    start == block_starts[-1],
+                    start == last_start,
                 )
                 for start in block_starts
             ]
@@ -62,35 +243,83 @@ class DeflateCompressor(BaseCompressor):
         a: int,
         b: int,
         final: bool,
-    ) -> Tuple[bytes, int, int]:
+    ) -> CompressedChunk:
         if isinstance(data, Future):
             with kev(".result"):
                 data = data.result()
 
+        mapped = data
         data = data[a:b]
 
-        with kev("compressobj", __name__):
-            # zlib compressobj are incredibly cheap, we'll just create a new one
-            # each time and let it go out of scope.
-            obj = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -15)
-        with kev("compress", __name__, size=len(data)):
-            # TODO benchmark to ensure the + isn't too expensive
-            buf: bytes = obj.compress(data)
-
-        with kev("flush", __name__, final=final):
-            # ref https://www.bolet.org/~pornin/deflate-flush-fr.html
-            if final:
-                # Passing the correct arg here saves 6 bytes vs compressing the
-                # block with a full flush and appending a final flush!
-                buf += obj.flush(zlib.Z_FINISH)
-            else:
-                buf += obj.flush(zlib.Z_FULL_FLUSH)
+        if final and self._oneshot is not None:
+            with kev("oneshot", __name__, size=len(data)):
+                # libdeflate's levels go to 12, but agree with zlib's on 1-9
+                level = 6 if self._compresslevel == -1 else self._compresslevel
+                buf: bytes = self._oneshot(data, level)
+        else:
+            with kev("compressobj", __name__):
+                if final:
+                    obj = self._zlib.compressobj(
+                        self._compresslevel, zlib.DEFLATED, -15
+                    )
+                else:
+                    assert self._freelist is not None
+                    obj = self._freelist.enter()
+            with kev("compress", __name__, size=len(data)):
+                # The += below copies, but that's ~40us for an incompressible
+                # block against ~25ms to compress it; a bytearray accumulator
+                # would copy twice.
+                buf = obj.compress(data)
+
+            with kev("flush", __name__, final=final):
+                # ref https://www.bolet.org/~pornin/deflate-flush-fr.html
+                if final:
+                    # Passing the correct arg here saves 6 bytes vs compressing
+                    # the block with a full flush and appending a final flush!
+                    buf += obj.flush(zlib.Z_FINISH)
+                else:
+                    # This writes the same 00 00 ff ff marker as Z_SYNC_FLUSH
+                    # would, so it costs nothing in size; the difference is
+                    # that it also drops the history, which is what makes obj
+                    # safe to hand to the next (unrelated) block.
+                    buf += obj.flush(zlib.Z_FULL_FLUSH)
+                    # Only returned on success; after an exception its state is
+                    # unknown.
+                    assert self._freelist is not None
+                    self._freelist.leave(obj)
 
         with kev("crc32", __name__):
-            crc = zlib.crc32(data)
+            # This is a second pass over the block, but a THREAD_BLOCK_SIZE block
+            # is still in cache from compressing it.  Interleaving crc32 with
+            # compress() in 64KiB pieces measured no faster.
+            crc = crc32(data)
+
+        m = mapped.obj if isinstance(mapped, memoryview) else None
+        if (
+            hasattr(mmap, "MADV_DONTNEED")
+            and isinstance(m, mmap.mmap)
+            and len(m) == len(mapped)
+        ):
+            # Done with these pages (`a` is a multiple of THREAD_BLOCK_SIZE, so
+            # page aligned); dropping them as we go keeps RSS bounded on
+            # multi-GB files.  They stay in the page cache.
+            with kev("madvise", __name__):
+                m.madvise(mmap.MADV_DONTNEED, a, len(data))
 
-        return (buf, len(data), crc)
+        return CompressedChunk(buf, len(data), crc)
 
-    def _decompress_for_testing(self, data: bytes) -> bytes:
+    def decompress_iter(self, data: bytes) -> Iterator[Union[bytes, memoryview]]:
+        # Like compressobj these are cheap (~100ns; the window is only allocated
+        # on first use), and they can't be reset for reuse.  Pooling via
+        # `.copy()` of a pristine one measured slower than just making a new one.
         obj = zlib.decompressobj(-15)
-        return obj.decompress(data)
+        # Input is fed in bounded slices too, because `unconsumed_tail` is a
+        # copy of whatever is left -- passing all of `data` at once makes this
+        # quadratic.
+        view = memoryview(data)
+        for i in range(0, len(view), DECOMPRESS_CHUNK_SIZE):
+            buf: Union[bytes, memoryview] = view[i : i + DECOMPRESS_CHUNK_SIZE]
+            while buf:
+                yield obj.decompress(buf, DECOMPRESS_CHUNK_SIZE)
+                buf = obj.unconsumed_tail
+        yield obj.flush()
@@ -1,12 +1,23 @@
 from __future__ import annotations
 
 from concurrent.futures import Executor, Future
-from typing import Optional, Sequence, Tuple, Union
-from zlib import crc32
+from typing import Iterator, Sequence, Union
 
-from keke import kev
+from .._crc32 import crc32
 
-from ._base import BaseCompressor
+from .._kev import kev
+from ._base import (
+    BaseCompressor,
+    completed_future,
+    CompressedChunk,
+    DECOMPRESS_CHUNK_SIZE,
+    SYNC_THRESHOLD,
+)
+
+# Large files are crc'd in pieces this big on the pool, and the consumer
+# combines them like it does deflate's blocks.  A lone crc32 is one thread's
+# worth of memory bandwidth; this is big enough that a submit is noise.
+THREAD_BLOCK_SIZE = 8 * 1024 * 1024
 
 
 class StoreCompressor(BaseCompressor):
@@ -23,9 +34,8 @@ class StoreCompressor(BaseCompressor):
         pool: Executor,
         size: int,
         mmap_future: Union[memoryview, Future[memoryview]],
-    ) -> Sequence[Future[Tuple[bytes, int, Optional[int]]]]:
-        # TODO Tuple[Union[bytes, memoryview], int, int]
-        def func() -> Tuple[bytes, int, int]:
+    ) -> Sequence[Future[CompressedChunk]]:
+        def func() -> CompressedChunk:
             with kev("read", __name__):
                 if isinstance(mmap_future, Future):
                     raw_data = mmap_future.result()
@@ -33,9 +43,42 @@ class StoreCompressor(BaseCompressor):
                     raw_data = mmap_future
             with kev("crc", __name__):
                 crc = crc32(raw_data)
-            return (raw_data, len(raw_data), crc)
+            return CompressedChunk(raw_data, len(raw_data), crc)
+
+        if size < SYNC_THRESHOLD and not isinstance(mmap_future, Future):
+            # Deflate and zstd don't do this; even tiny inputs take them longer
+            # (mostly setup) than the handoff costs, and this runs on the
+            # writer's single open-consumer thread.
+            return [completed_future(func())]
+        elif size <= THREAD_BLOCK_SIZE:
+            return [pool.submit(func)]
 
-        return [pool.submit(func)]
+        with kev("pool.submit", __name__):
+            return [
+                pool.submit(
+                    self._crc_block,
+                    mmap_future,
+                    start,
+                    min(size, start + THREAD_BLOCK_SIZE),
+                )
+                for start in range(0, size, THREAD_BLOCK_SIZE)
+            ]
+
+    def _crc_block(
+        self,
+        data: Union[memoryview, Future[memoryview]],
+        a: int,
+        b: int,
+    ) -> CompressedChunk:
+        if isinstance(data, Future):
+            with kev(".result"):
+                data = data.result()
+        data = data[a:b]
+        with kev("crc", __name__):
+            crc = crc32(data)
+        return CompressedChunk(data, len(data), crc)
 
-    def _decompress_for_testing(self, data: bytes) -> bytes:
-        return data
+    def decompress_iter(self, data: bytes) -> Iterator[Union[bytes, memoryview]]:
+        view = memoryview(data)
+        for i in range(0, len(view), DECOMPRESS_CHUNK_SIZE):
+            yield view[i : i + DECOMPRESS_CHUNK_SIZE]
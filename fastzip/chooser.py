@@ -1,12 +1,29 @@
+import functools
 import operator
 import re
 from dataclasses import dataclass
-from typing import Any, Callable, Optional, Sequence, Union
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
 
 from .algo import find_compressor_cls
 from .types import LocalFileHeader
 
 
+class _RegexMatch:
+    """
+    What `op_regex_match` returns; the compiled pattern is kept around so that
+    `CompressionChooser` can merge consecutive ones.
+    """
+
+    def __init__(self, pat: str, flags: int = 0) -> None:
+        self.regex = re.compile(pat, flags)
+
+    def __call__(self, subj: str) -> bool:
+        return self.regex.fullmatch(subj) is not None
+
+    match = __call__
+
+
+@functools.lru_cache(maxsize=None)
 def op_regex_match(pat: str, flags: int = 0) -> Callable[[str], bool]:
     """
     Operator function that returns a closure that matches strings.
@@ -24,15 +41,14 @@ def op_regex_match(pat: str, flags: int = 0) -> Callable[[str], bool]:
     False
 
     Flags are accepted, but not particularly useful except for `IGNORECASE`.
-    """
-    r = re.compile(pat, flags)
-
-    def inner(subj: str) -> bool:
-        return r.fullmatch(subj) is not None
 
-    return inner
+    The returned matchers are stateless, so the same one is returned for the
+    same arguments.
+    """
+    return _RegexMatch(pat, flags)
 
 
+@functools.lru_cache(maxsize=None)
 def op_fnmatch(pat: str) -> Callable[[str], bool]:
     """
     Operator function that returns a closure that matches filenames.
@@ -65,6 +81,93 @@ class Rule:
     algo_str: str
 
 
+_SCOPED_FLAGS = (
+    (re.IGNORECASE, "i"),
+    (re.MULTILINE, "m"),
+    (re.DOTALL, "s"),
+)
+_LEADING_FLAGS_RE = re.compile(r"\(\?[aiLmsux]+\)")
+# Overly conservative, also catches e.g. octal escapes.  The second is a
+# conditional like `(?(1)a|b)`, which refers to a group by number too.
+_BACKREF_RE = re.compile(r"\\\d|\(\?\(")
+
+
+def _scoped_pattern(regex: "re.Pattern[str]") -> Optional[str]:
+    """
+    Returns `regex` as a pattern that can be embedded in a larger one with the
+    same behavior, or None if we aren't confident that's possible.
+    """
+    # Group numbers or names would change (or collide)
+    if regex.groupindex or _BACKREF_RE.search(regex.pattern):
+        return None
+    letters = ""
+    remaining = regex.flags & ~re.UNICODE
+    for flag, letter in _SCOPED_FLAGS:
+        if remaining & flag:
+            letters += letter
+            remaining &= ~flag
+    if remaining:
+        # ASCII, LOCALE, DEBUG can't be scoped, and VERBOSE would let a
+        # trailing comment swallow our closing paren
+        return None
+    # Global flags (e.g. from pywildcard) are already accounted for in
+    # regex.flags, and are only valid at the start of a whole pattern.
+    m = _LEADING_FLAGS_RE.match(regex.pattern)
+    rest = regex.pattern[m.end() :] if m else regex.pattern
+    if _LEADING_FLAGS_RE.search(rest):
+        return None
+    return f"(?{letters}:{rest})" if letters else f"(?:{rest})"
+
+
+@dataclass
+class _RegexGroup:
+    """
+    Consecutive filename regex rules, merged into a single alternation.
+    Alternatives are tried in order, so the first rule that would have matched
+    on its own is the one whose wrapping group participates.
+    """
+
+    lfh_attr: str
+    regex: "re.Pattern[str]"
+    # (group number, algo_str) for each original rule
+    algos: List[Tuple[int, str]]
+
+
+def _merge_regex_rules(rules: Sequence[Rule]) -> List[Union[Rule, _RegexGroup]]:
+    steps: List[Union[Rule, _RegexGroup]] = []
+    run: List[Tuple[Rule, str]] = []
+
+    def end_run() -> None:
+        if len(run) == 1:
+            steps.append(run[0][0])
+        elif run:
+            parts = []
+            algos = []
+            group = 1
+            for rule, pat in run:
+                parts.append(f"({pat})")
+                algos.append((group, rule.algo_str))
+                assert isinstance(rule.operator, _RegexMatch)
+                group += 1 + rule.operator.regex.groups
+            steps.append(
+                _RegexGroup(run[0][0].lfh_attr, re.compile("|".join(parts)), algos)
+            )
+        run.clear()
+
+    for rule in rules:
+        pat = None
+        if rule.rhs is None and isinstance(rule.operator, _RegexMatch):
+            pat = _scoped_pattern(rule.operator.regex)
+        if pat is None or (run and run[0][0].lfh_attr != rule.lfh_attr):
+            end_run()
+        if pat is None:
+            steps.append(rule)
+        else:
+            run.append((rule, pat))
+    end_run()
+    return steps
+
+
 class CompressionChooser:
     """
     A way to choose the compression (type/params) based on file info.
@@ -81,23 +184,55 @@ class CompressionChooser:
     it belongs in whatever consumes the compression futures.
     """
 
-    rules: Sequence[Rule]
+    _rules: Tuple[Rule, ...]
 
     def __init__(self, default: str = "store", rules: Sequence[Rule] = ()) -> None:
-        self.rules = list(rules)
-        # TODO: property set that validates rules
         self.default_compressor = default
+        self.rules = rules
+
+    @property
+    def rules(self) -> Sequence[Rule]:
+        """
+        The rules, in order.  This is a tuple so that it can't be changed in
+        place; assign a new sequence instead.
+        """
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules: Sequence[Rule]) -> None:
+        self._rules = tuple(rules)
         self._validate_compressor_names()
+        # Every file is run through the rules, so runs of regex rules are
+        # matched with one regex call instead of one per rule.
+        self._steps = _merge_regex_rules(self._rules)
+
+    def compressor_names(self) -> List[str]:
+        """
+        Every compressor (with params) this can choose, without duplicates.
+        """
+        names = [self.default_compressor]
+        for rule in self.rules:
+            if rule.algo_str not in names:
+                names.append(rule.algo_str)
+        return names
 
     def _validate_compressor_names(self) -> None:
         # TODO: somewhere should validate the field names
-        for rule in self.rules:
-            find_compressor_cls(rule.algo_str)
-        find_compressor_cls(self.default_compressor)
+        for name in self.compressor_names():
+            find_compressor_cls(name)
 
     def _choose_compressor(self, partial_lfh: LocalFileHeader) -> str:
-        for rule in self.rules:
-            if rule.rhs is None:
+        if not self.rules:
+            # e.g. a forced --algo
+            return self.default_compressor
+        for rule in self._steps:
+            if isinstance(rule, _RegexGroup):
+                m = rule.regex.fullmatch(getattr(partial_lfh, rule.lfh_attr))
+                if m is not None:
+                    for group, algo_str in rule.algos:
+                        if m.start(group) != -1:
+                            return algo_str
+            elif rule.rhs is None:
                 if rule.operator(getattr(partial_lfh, rule.lfh_attr)):  # type: ignore
                     return rule.algo_str
             else:
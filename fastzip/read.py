@@ -1,8 +1,20 @@
+import os
+import struct
 import sys
 from pathlib import Path
-from typing import Callable, IO, Iterator, Optional, Tuple
-
-from .types import EndOfLocalFiles, LocalFileHeader
+from typing import Callable, Dict, IO, Iterator, List, Optional, Tuple
+
+from .types import (
+    CentralDirectoryHeader,
+    EndOfLocalFiles,
+    EOCD_FORMAT,
+    EOCD_SIGNATURE,
+    LocalFileHeader,
+    ZIP64_EOCD_FORMAT,
+    ZIP64_EOCD_LOCATOR_FORMAT,
+    ZIP64_EOCD_LOCATOR_SIGNATURE,
+    ZIP64_EOCD_SIGNATURE,
+)
 from .util import _readn
 
 
@@ -66,9 +78,145 @@ class RZipStream(RZipBase):
             except EndOfLocalFiles:
                 break
 
-            buf2 = _readn(self._fobj, lfh.csize)
             if callback is None or callback(lfh):
-                yield (lfh, buf, buf2)
+                yield (lfh, buf, _readn(self._fobj, lfh.csize))
+            else:
+                self._fobj.seek(lfh.csize, os.SEEK_CUR)
+
+    def entry_offsets(
+        self, callback: Optional[Callable[[LocalFileHeader], bool]] = None
+    ) -> Iterator[Tuple[LocalFileHeader, bytes, int]]:
+        """
+        Like `entries` but yields `(local_file_header, header_data, offset)`,
+        seeking past each file's data rather than reading it.
+
+        The caller can read the `local_file_header.csize` bytes at `offset`
+        later (or in parallel) using something like `os.pread` on this file,
+        which remains open.
+
+        Only call this function once.
+        """
+
+        while True:
+            try:
+                lfh, buf = LocalFileHeader.read_from(self._fobj)
+            except EndOfLocalFiles:
+                break
+
+            offset = self._fobj.tell()
+            self._fobj.seek(lfh.csize, os.SEEK_CUR)
+            if callback is None or callback(lfh):
+                yield (lfh, buf, offset)
+
+    def fileno(self) -> int:
+        return self._fobj.fileno()
+
+    def close(self) -> None:
+        self._fobj.close()
+
+    def __enter__(self) -> "RZipStream":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class RZipCentralDirectory(RZipBase):
+    """
+    Reads a zip by way of its central directory.
+
+    This finds entries without parsing (or even reading) the local file header
+    and data of the ones you don't want, which for picking a few files out of a
+    big archive is much less work than `RZipStream`.  Like that class, it
+    assumes there are no gaps between files, and only handles single-disk
+    archives.
+    """
+
+    _fobj: IO[bytes]
+
+    def __init__(self, filename: Path, fobj: Optional[IO[bytes]] = None) -> None:
+        self._filename = filename
+        if fobj:
+            # Must be seekable; the position doesn't matter
+            self._fobj = fobj
+        else:
+            self._fobj = open(filename, "rb")
+
+    def _find_central_directory(self) -> Tuple[int, int]:
+        """
+        Returns `(offset, size)` of the central directory, from the (zip64)
+        end of central directory record.
+        """
+        file_size = self._fobj.seek(0, os.SEEK_END)
+        # The EOCD is only followed by its comment, which is at most 64KiB
+        tail_start = max(0, file_size - struct.calcsize(EOCD_FORMAT) - 0xFFFF)
+        self._fobj.seek(tail_start)
+        tail = _readn(self._fobj, file_size - tail_start)
+        i = tail.rfind(struct.pack("<L", EOCD_SIGNATURE))
+        if i == -1:
+            raise ValueError("No end of central directory")
+        eocd = struct.unpack_from(EOCD_FORMAT, tail, i)
+        size, offset = eocd[5], eocd[6]
+
+        # When there's a zip64 locator right before the EOCD, its record has
+        # the real values (the EOCD's may be clamped).
+        locator_size = struct.calcsize(ZIP64_EOCD_LOCATOR_FORMAT)
+        if i >= locator_size:
+            locator = struct.unpack_from(
+                ZIP64_EOCD_LOCATOR_FORMAT, tail, i - locator_size
+            )
+            if locator[0] == ZIP64_EOCD_LOCATOR_SIGNATURE:
+                self._fobj.seek(locator[2])
+                e64 = struct.unpack(
+                    ZIP64_EOCD_FORMAT,
+                    _readn(self._fobj, struct.calcsize(ZIP64_EOCD_FORMAT)),
+                )
+                if e64[0] != ZIP64_EOCD_SIGNATURE:
+                    raise ValueError("Invalid signature %0x" % (e64[0],))
+                size, offset = e64[8], e64[9]
+        return offset, size
+
+    def entries(
+        self, callback: Optional[Callable[[CentralDirectoryHeader], bool]] = None
+    ) -> Iterator[Tuple[CentralDirectoryHeader, int, int]]:
+        """
+        Yields `(central_directory_header, offset, length)` for each entry that
+        `callback(central_directory_header)` returns True, in central directory
+        order.
+
+        The `length` bytes at `offset` are the entry's local file header, extra
+        data, and compressed data, exactly as in this zip.  To get a
+        `LocalFileHeader`, seek to `offset` and use `LocalFileHeader.read_from`.
+        """
+        cd_offset, cd_size = self._find_central_directory()
+        self._fobj.seek(cd_offset)
+        buf = _readn(self._fobj, cd_size)
+
+        headers: List[CentralDirectoryHeader] = []
+        pos = 0
+        while pos < len(buf):
+            cdh, pos = CentralDirectoryHeader.unpack_from(buf, pos)
+            headers.append(cdh)
+
+        # Each entry ends where the next one (or the central directory) starts
+        starts = sorted(h.relative_offset_of_lfh for h in headers)
+        ends: Dict[int, int] = dict(zip(starts, starts[1:] + [cd_offset]))
+        for cdh in headers:
+            if callback is None or callback(cdh):
+                start = cdh.relative_offset_of_lfh
+                yield (cdh, start, ends[start] - start)
+
+    def fileno(self) -> int:
+        return self._fobj.fileno()
+
+    def close(self) -> None:
+        self._fobj.close()
+
+    def __enter__(self) -> "RZipCentralDirectory":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 from .algo import LookupRoundtripTest, WrappedFileTest
 from .chooser import ChooserTest
+from .crc32 import Crc32CombineTest
 from .read import ReadTest
-from .types import LocalFileHeaderTest
+from .types import CentralDirectoryHeaderTest, LocalFileHeaderTest
 from .util import UtilTest
 from .write import WZipTest
 
@@ -9,8 +10,10 @@ __all__ = [
     "LookupRoundtripTest",
     "WrappedFileTest",
     "ChooserTest",
+    "Crc32CombineTest",
     "UtilTest",
     "ReadTest",
     "WZipTest",
     "LocalFileHeaderTest",
+    "CentralDirectoryHeaderTest",
 ]
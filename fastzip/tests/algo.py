@@ -1,10 +1,17 @@
 import concurrent.futures
 import io
+import mmap
 import os
 import unittest
+import zlib
+from typing import IO
+from unittest import mock
 
 from fastzip.algo import find_compressor_cls
-from fastzip.algo._wrapfile import WrappedFile
+from fastzip.algo._base import DECOMPRESS_CHUNK_SIZE, parse_params
+from fastzip.algo._freelist import FactoryFreelist
+from fastzip.algo._wrapfile import _BUFFER_FREELISTS, POOLED_BYTES_PER_SIZE, WrappedFile
+from fastzip.algo.deflate import _block_size, DEFAULT_BLOCK_SIZE
 
 DEMO_DATA = b"Hello World"
 
@@ -31,6 +38,82 @@ class LookupRoundtripTest(unittest.TestCase):
     def test_zstd(self) -> None:
         self._test("zstd")
 
+    def test_deflate_empty(self) -> None:
+        inst = find_compressor_cls("deflate")[0](threads=1)
+        with concurrent.futures.ThreadPoolExecutor(1) as e:
+            (f,) = inst.compress_to_futures(pool=e, size=0, mmap_future=memoryview(b""))
+        data, raw_length, crc = f.result()
+        self.assertEqual((0, 0), (raw_length, crc))
+        self.assertEqual(b"", inst._decompress_for_testing(bytes(data)))
+
+    def test_deflate_backend_only_for_compress(self) -> None:
+        data = zlib.compress(b"abc", 6, -15)
+        with mock.patch("fastzip.algo.deflate.DEFLATE_BACKEND", "bogus"):
+            inst = find_compressor_cls("deflate")[0](threads=1)
+            self.assertEqual(b"abc", inst._decompress_for_testing(data))
+            with concurrent.futures.ThreadPoolExecutor(1) as e:
+                with self.assertRaises(ValueError):
+                    inst.compress_to_futures(
+                        pool=e, size=3, mmap_future=memoryview(b"abc")
+                    )
+
+    def test_deflate_reused_compressobj(self) -> None:
+        from fastzip.algo.deflate import THREAD_BLOCK_SIZE
+
+        data = (b"abc" * 1000 + os.urandom(1000)) * (THREAD_BLOCK_SIZE // 2000)
+        inst = find_compressor_cls("deflate")[0](threads=1)
+        outputs = []
+        for _ in range(2):
+            # The second time around, non-final blocks get reused compressobjs
+            with concurrent.futures.ThreadPoolExecutor(1) as e:
+                futs = inst.compress_to_futures(
+                    pool=e, size=len(data), mmap_future=memoryview(data)
+                )
+                outputs.append(b"".join(f.result()[0] for f in futs))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(data, inst._decompress_for_testing(outputs[1]))
+
+    def test_parse_params(self) -> None:
+        self.assertEqual({}, parse_params(""))
+        d = parse_params("compresslevel=9,long")
+        self.assertEqual({"compresslevel": 9, "long": 1}, d)
+        # Cached, but callers (e.g. zstd) pop from the result
+        d.pop("compresslevel")
+        self.assertEqual(
+            {"compresslevel": 9, "long": 1}, parse_params("compresslevel=9,long")
+        )
+
+    def test_deflate_block_size(self) -> None:
+        self.assertEqual(DEFAULT_BLOCK_SIZE, _block_size(""))
+        self.assertEqual(3 * mmap.PAGESIZE, _block_size(str(3 * mmap.PAGESIZE + 1)))
+        self.assertEqual(mmap.PAGESIZE, _block_size("1"))
+        for bad in ("1M", "0", "-4096"):
+            with self.assertLogs("fastzip.algo.deflate", "WARNING"):
+                self.assertEqual(DEFAULT_BLOCK_SIZE, _block_size(bad))
+        for garbage in ("", "12Q\n", "lots"):
+            with mock.patch(
+                "fastzip.algo.deflate.open",
+                mock.mock_open(read_data=garbage),
+                create=True,
+            ):
+                self.assertEqual(DEFAULT_BLOCK_SIZE, _block_size("auto"))
+        auto = _block_size("auto")
+        self.assertEqual(0, auto % mmap.PAGESIZE)
+        self.assertLessEqual(auto, 8 * 1024 * 1024)
+
+    def test_deflate_decompress_iter_chunks(self) -> None:
+        # Both incompressible and very compressible, spanning several chunks
+        data = os.urandom(DECOMPRESS_CHUNK_SIZE * 2 + 1) + b"a" * (
+            DECOMPRESS_CHUNK_SIZE * 3
+        )
+        obj = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = obj.compress(data) + obj.flush()
+
+        inst = find_compressor_cls("deflate")[0](threads=1)
+        chunks = list(inst.decompress_iter(compressed))
+        self.assertEqual(data, b"".join(chunks))
+        self.assertLessEqual(max(len(c) for c in chunks), DECOMPRESS_CHUNK_SIZE)
+
 
 class WrappedFileTest(unittest.TestCase):
     def test_stat(self) -> None:
@@ -59,3 +142,29 @@ class WrappedFileTest(unittest.TestCase):
         s, b = w.mmapwrapper()
         self.assertEqual(expected_size, s)
         self.assertEqual(b, f.getvalue())
+
+    def test_pooled_buffer_released(self) -> None:
+        with open(__file__, "rb") as f:
+            with WrappedFile(f) as w:
+                s, b = w.mmapwrapper()
+                self.assertIsNotNone(w._buffer)
+                f.seek(0)
+                self.assertEqual(bytes(b), f.read())
+            self.assertIsNone(w._buffer)
+
+    def test_buffer_freelist_bounded(self) -> None:
+        fl = FactoryFreelist(bytearray, max_size=2)
+        objs = [fl.enter() for _ in range(3)]
+        for o in objs:
+            fl.leave(o)
+        self.assertEqual(objs[:2], fl.freelist)
+        for size, freelist in _BUFFER_FREELISTS.items():
+            self.assertEqual(POOLED_BYTES_PER_SIZE // size, freelist.max_size)
+
+    def test_exit_closes_pending_future(self) -> None:
+        fut: "concurrent.futures.Future[IO[bytes]]" = concurrent.futures.Future()
+        f = io.BytesIO(b"abc")
+        fut.set_result(f)
+        with WrappedFile(fut):
+            pass
+        self.assertTrue(f.closed)
@@ -1,9 +1,16 @@
+import operator
 import unittest
 from concurrent.futures import ThreadPoolExecutor
 
 from fastzip.algo import find_compressor_cls
 from fastzip.algo.zstd import ZstdCompressor
-from fastzip.chooser import CompressionChooser, DEFAULT_CHOOSER
+from fastzip.chooser import (
+    CompressionChooser,
+    DEFAULT_CHOOSER,
+    op_fnmatch,
+    op_regex_match,
+    Rule,
+)
 from fastzip.types import LocalFileHeader
 
 
@@ -90,3 +97,66 @@ class ChooserTest(unittest.TestCase):
                 )
             ),
         )
+
+    def test_rules_reassigned(self) -> None:
+        c = CompressionChooser(
+            default="deflate",
+            rules=[Rule("filename", op_regex_match(r".*\.zip"), None, "store")],
+        )
+        lfh = LocalFileHeader._for_testing(usize=100, filename="a.zip")
+        self.assertEqual("store", c._choose_compressor(lfh))
+        c.rules = [Rule("filename", op_regex_match(r".*\.zip"), None, "zstd")]
+        self.assertEqual("zstd", c._choose_compressor(lfh))
+        # Fixed otherwise
+        with self.assertRaises(AttributeError):
+            c.rules.append(Rule("usize", operator.lt, 12, "store"))
+
+    def test_conditional_group_not_merged(self) -> None:
+        rules = [
+            Rule("filename", op_regex_match(r"q.*"), None, "store"),
+            # Group 1 would be the wrapper around the rule above once merged
+            Rule("filename", op_regex_match(r"(x)?(?(1)y|z).*"), None, "zstd"),
+        ]
+        c = CompressionChooser(default="deflate", rules=rules)
+        self.assertEqual(2, len(c._steps))
+        for filename, expected in (("xy", "zstd"), ("z", "zstd"), ("xz", "deflate")):
+            lfh = LocalFileHeader._for_testing(usize=100, filename=filename)
+            self.assertEqual(expected, c._choose_compressor(lfh), filename)
+
+    def test_merged_regex_rules(self) -> None:
+        rules = [
+            Rule("filename", op_fnmatch("**/*.txt"), None, "deflate@compresslevel=1"),
+            Rule("filename", op_regex_match(r".*\.(zip|jar)"), None, "store"),
+            Rule("usize", operator.lt, 12, "store"),
+            Rule("filename", op_regex_match(r"(?i).*\.LOG"), None, "zstd"),
+            Rule("filename", op_regex_match(r"(.)\1.*"), None, "deflate"),
+            Rule("filename", op_regex_match(r"a.*"), None, "deflate@compresslevel=9"),
+        ]
+        c = CompressionChooser(default="deflate", rules=rules)
+        # Only the first two get merged; the backreference can't be, and the
+        # rules on either side of it have to stay in order
+        self.assertEqual(5, len(c._steps))
+
+        for filename in (
+            "a/b.txt",
+            "b.txt",
+            "x.jar",
+            "a.zip",
+            "a.log",
+            "b.Log",
+            "aab",
+            "abc",
+            "zzz",
+        ):
+            for usize in (1, 100):
+                lfh = LocalFileHeader._for_testing(usize=usize, filename=filename)
+                expected = c.default_compressor
+                for rule in rules:
+                    if rule.rhs is None:
+                        hit = rule.operator(getattr(lfh, rule.lfh_attr))  # type: ignore
+                    else:
+                        hit = rule.operator(getattr(lfh, rule.lfh_attr), rule.rhs)  # type: ignore
+                    if hit:
+                        expected = rule.algo_str
+                        break
+                self.assertEqual(expected, c._choose_compressor(lfh), (filename, usize))
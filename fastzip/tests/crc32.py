@@ -0,0 +1,55 @@
+import unittest
+import zlib
+
+from fastzip._crc32_combine import (
+    _crc32_combine_gen_pure,
+    _crc32_combine_op_pure,
+    _crc32_combine_pure,
+    crc32_combine,
+    crc32_combine_gen,
+    crc32_combine_many,
+    crc32_combine_op,
+)
+
+DEMO_DATA = [b"", b"a", b"Hello World", b"abc" * 1000, bytes(range(256)) * 5]
+
+
+class Crc32CombineTest(unittest.TestCase):
+    def test_pure_matches_zlib(self) -> None:
+        for a in DEMO_DATA:
+            for b in DEMO_DATA:
+                self.assertEqual(
+                    zlib.crc32(a + b),
+                    _crc32_combine_pure(zlib.crc32(a), zlib.crc32(b), len(b)),
+                )
+
+    def test_matches_pure(self) -> None:
+        for n in (0, 1, 2, 1023, 1 << 20, (1 << 32) + 7):
+            self.assertEqual(
+                _crc32_combine_pure(0x12345678, 0x9ABCDEF0, n),
+                crc32_combine(0x12345678, 0x9ABCDEF0, n),
+            )
+
+    def test_gen_op(self) -> None:
+        chunk = b"xyz" * 100
+        op = crc32_combine_gen(len(chunk))
+        crc = zlib.crc32(chunk)
+        for i in range(2, 5):
+            crc = crc32_combine_op(crc, zlib.crc32(chunk), op)
+            self.assertEqual(zlib.crc32(chunk * i), crc)
+
+    def test_gen_op_matches_pure(self) -> None:
+        for n in (0, 1, 1023, 1 << 20, (1 << 32) + 7):
+            op = crc32_combine_gen(n)
+            self.assertEqual(_crc32_combine_gen_pure(n), op)
+            self.assertEqual(
+                _crc32_combine_op_pure(0x12345678, 0x9ABCDEF0, op),
+                crc32_combine_op(0x12345678, 0x9ABCDEF0, op),
+            )
+
+    def test_many(self) -> None:
+        self.assertEqual(0, crc32_combine_many([]))
+        self.assertEqual(
+            zlib.crc32(b"".join(DEMO_DATA)),
+            crc32_combine_many((zlib.crc32(d), len(d)) for d in DEMO_DATA),
+        )
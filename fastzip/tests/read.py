@@ -1,9 +1,16 @@
 import io
+import os
+import tempfile
+import time
 import unittest
 import zipfile
 from pathlib import Path
+from unittest import mock
 
-from fastzip.read import RZipStream
+import fastzip.write
+from fastzip.__main__ import compress
+from fastzip.algo._base import CompressedChunk
+from fastzip.read import RZipCentralDirectory, RZipStream
 from fastzip.write import WZip
 
 
@@ -35,3 +42,104 @@ class ReadTest(unittest.TestCase):
 
         zf = zipfile.ZipFile(b3)
         self.assertEqual(["path1", "path2"], zf.namelist())
+
+    @unittest.skipUnless(hasattr(os, "pread"), "needs pread")
+    def test_zipmerge_offsets(self) -> None:
+        with tempfile.TemporaryFile() as t:
+            with zipfile.ZipFile(t, mode="w") as zf1:
+                zf1.writestr("path1", "Data1")
+                zf1.writestr("path2", "Data2")
+            t.seek(0)
+
+            b3 = io.BytesIO()
+            with WZip(Path("foo.zip"), fobj=b3) as z:
+                zi = RZipStream(Path("zip1"), fobj=t)
+                for lfh, header_data, offset in zi.entry_offsets():
+                    z.enqueue_precompressed_at(lfh, zi.fileno(), offset)
+
+        zf = zipfile.ZipFile(b3)
+        self.assertEqual(["path1", "path2"], zf.namelist())
+        self.assertEqual(b"Data2", zf.read("path2"))
+
+    def test_entries_callback(self) -> None:
+        b = io.BytesIO()
+        with zipfile.ZipFile(b, mode="w") as zf:
+            zf.writestr("path1", "Data1")
+            zf.writestr("path2", "Data2")
+            zf.writestr("path3", "Data3")
+        b.seek(0)
+
+        entries = RZipStream(Path("zip"), fobj=b).entries(
+            lambda lfh: lfh.filename != "path2"
+        )
+        self.assertEqual(
+            [("path1", b"Data1"), ("path3", b"Data3")],
+            [(lfh.filename, data) for lfh, _, data in entries],
+        )
+
+    def test_compress_merge(self) -> None:
+        slow_read = fastzip.write._read_precompressed
+
+        def _read_precompressed(fd: int, n: int, offset: int) -> CompressedChunk:
+            # Still reading the first zip after we've moved on to the second
+            time.sleep(0.001)
+            return slow_read(fd, n, offset)
+
+        with tempfile.TemporaryDirectory() as d:
+            inputs = []
+            for i in range(2):
+                inputs.append(Path(d, f"in{i}.zip"))
+                with zipfile.ZipFile(inputs[-1], mode="w") as zf:
+                    for j in range(50):
+                        zf.writestr(f"{i}/{j}", f"Data{i}.{j}")
+
+            out = Path(d, "out.zip")
+            with mock.patch("fastzip.write._read_precompressed", _read_precompressed):
+                rc = compress(str(out), ["+" + str(p) for p in inputs], io_threads=1)
+            self.assertEqual(0, rc)
+            with zipfile.ZipFile(out) as zf:
+                self.assertIsNone(zf.testzip())
+                self.assertEqual(
+                    [f"{i}/{j}" for i in range(2) for j in range(50)], zf.namelist()
+                )
+                self.assertEqual(b"Data1.49", zf.read("1/49"))
+
+    def test_central_directory(self) -> None:
+        b1 = io.BytesIO()
+        with zipfile.ZipFile(b1, mode="w") as zf:
+            zf.writestr("path1", "Data1")
+            zf.writestr("path2", "Data2" * 100, compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr("path3", "Data3")
+            zf.comment = b"PK comment"
+
+        archives = [b1]
+        for force_zip64 in (False, True):
+            b2 = io.BytesIO()
+            with WZip(Path("foo.zip"), fobj=b2, force_zip64=force_zip64) as z:
+                b1.seek(0)
+                for lfh, header_data, file_data in RZipStream(
+                    Path("zip1"), fobj=b1
+                ).entries():
+                    z.enqueue_precompressed(lfh, header_data, file_data)
+            archives.append(b2)
+
+        for b in archives:
+            b.seek(0)
+            expected = [
+                (lfh.filename, header_data + file_data)
+                for lfh, header_data, file_data in RZipStream(
+                    Path("zip"), fobj=b
+                ).entries(lambda lfh: lfh.filename != "path2")
+            ]
+            raw = b.getvalue()
+            with RZipCentralDirectory(Path("zip"), fobj=b) as cd:
+                self.assertEqual(
+                    expected,
+                    [
+                        (cdh.filename, raw[offset : offset + length])
+                        for cdh, offset, length in cd.entries(
+                            lambda cdh: cdh.filename != "path2"
+                        )
+                    ],
+                )
+            self.assertTrue(b.closed)
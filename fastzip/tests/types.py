@@ -1,8 +1,16 @@
+import time
 import unittest
 from dataclasses import asdict
 from io import BytesIO
+from pathlib import Path
 
-from fastzip.types import LocalFileHeader
+from fastzip.algo._wrapfile import WrappedFile
+from fastzip.types import (
+    BadLocalFileSignature,
+    CentralDirectoryHeader,
+    EndOfLocalFiles,
+    LocalFileHeader,
+)
 
 
 class LocalFileHeaderTest(unittest.TestCase):
@@ -15,6 +23,19 @@ class LocalFileHeaderTest(unittest.TestCase):
         h2, buf = LocalFileHeader.read_from(BytesIO(data))
         self.assertEqual(asdict(h), asdict(h2))
 
+    def test_signature(self) -> None:
+        lfh = LocalFileHeader._for_testing(123, "foo")
+        cdh = CentralDirectoryHeader.from_lfh_and_relative_offset(lfh, 0)
+        for data, exc in (
+            (cdh.dump(), EndOfLocalFiles),
+            (b"PK\x07\x08" + bytes(40), BadLocalFileSignature),
+        ):
+            fo = BytesIO(b"x" + data)
+            fo.seek(1)
+            with self.assertRaises(exc):
+                LocalFileHeader.read_from(fo)
+            self.assertEqual(1, fo.tell())
+
     def test_zip64(self) -> None:
         h = LocalFileHeader._for_testing(8_000_000_000, "foo")
         self.assertEqual(20, h.version_needed)
@@ -24,3 +45,55 @@ class LocalFileHeaderTest(unittest.TestCase):
         self.assertEqual(8_000_000_000, h2.usize)
         self.assertEqual(20, h.version_needed)
         self.assertEqual(45, h2.version_needed)
+
+    def test_from_wrapped_file_mtime(self) -> None:
+        mtime = int(time.mktime((2021, 6, 15, 13, 45, 31, 0, 0, -1)))
+        h = LocalFileHeader.from_wrapped_file(
+            Path("/a/b.txt"), WrappedFile(BytesIO(b"")), synthetic_mtime=mtime
+        )
+        # Two-second resolution
+        self.assertEqual((13 << 11 | 45 << 5 | 15), h.mtime)
+        self.assertEqual(((2021 - 1980) << 9 | 6 << 5 | 15), h.mdate)
+        self.assertEqual("a/b.txt", h.filename)
+
+    def test_from_wrapped_file_utf8(self) -> None:
+        h = LocalFileHeader.from_wrapped_file(
+            Path("café.txt"), WrappedFile(BytesIO(b""))
+        )
+        # Bytes, not characters
+        self.assertEqual(9, h.filename_length)
+        data, ver = h.dump()
+        h2, buf = LocalFileHeader.read_from(BytesIO(data))
+        self.assertEqual(9, h2.filename_length)
+        self.assertEqual("café.txt", h2.filename)
+
+    def test_rename(self) -> None:
+        h = LocalFileHeader.from_wrapped_file(Path("a.txt"), WrappedFile(BytesIO(b"")))
+        h.filename = "café/b.txt"
+        data, ver = h.dump()
+        h2, buf = LocalFileHeader.read_from(BytesIO(data))
+        self.assertEqual("café/b.txt", h2.filename)
+        self.assertEqual(11, h2.filename_length)
+
+    def test_cp437_filename(self) -> None:
+        h = LocalFileHeader._for_testing(0, "cafX")
+        # Without the utf-8 flag, names are cp437
+        data = h.dump()[0].replace(b"cafX", b"caf\x82")
+        h2, buf = LocalFileHeader.read_from(BytesIO(data))
+        self.assertEqual("café", h2.filename)
+
+
+class CentralDirectoryHeaderTest(unittest.TestCase):
+    def test_zip64(self) -> None:
+        lfh = LocalFileHeader._for_testing(8_000_000_000, "foo")
+        lfh.csize = 1234
+        h = CentralDirectoryHeader.from_lfh_and_relative_offset(lfh, 5_000_000_000)
+        data = h.dump()
+        h2, pos = CentralDirectoryHeader.unpack_from(data, 0)
+        self.assertEqual(len(data), pos)
+        # Only the two that overflowed
+        self.assertEqual(20, h2.extra_length)
+        self.assertEqual(8_000_000_000, h2.usize)
+        self.assertEqual(1234, h2.csize)
+        self.assertEqual(5_000_000_000, h2.relative_offset_of_lfh)
+        self.assertEqual(45, h2.version_needed)
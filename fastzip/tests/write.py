@@ -1,12 +1,19 @@
 import io
 import os
 import tempfile
+import time
 import unittest
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
+from unittest import mock
 
+import fastzip.write
 from fastzip.algo._queue import QueueItem
 from fastzip.algo._wrapfile import WrappedFile
+from fastzip.algo.deflate import DeflateCompressor
 from fastzip.chooser import CompressionChooser
 
 from fastzip.types import LocalFileHeader
@@ -15,29 +22,24 @@ from fastzip.write import WZip
 
 class WZipTest(unittest.TestCase):
     def test_instantiate(self) -> None:
-        with tempfile.NamedTemporaryFile() as z:
-            m = WZip(filename=Path("foo.zip"), fobj=z.file)
-            self.assertEqual(os.cpu_count(), m._threads)
-            m._shutdown()  # so _we_ can read the queue
-            m._consumer_thread.join()
+        m = WZip(filename=Path("foo.zip"), fobj=io.BytesIO(), start_consumer=False)
+        self.assertEqual(os.cpu_count(), m._threads)
 
     def test_compress_default_should_be_deflate(self) -> None:
-        with tempfile.NamedTemporaryFile() as z:
-            m = WZip(filename=Path("foo.zip"), fobj=z.file)
-            m._shutdown()  # so _we_ can read the queue
-            m._consumer_thread.join()
-            d = b"foo" * 100
-            m.enqueue(
-                LocalFileHeader._for_testing(usize=len(d), filename="foo/bar.py"),
-                WrappedFile(io.BytesIO(d)),
-            )
+        # No consumers, so _we_ can read the queue
+        m = WZip(filename=Path("foo.zip"), fobj=io.BytesIO(), start_consumer=False)
+        d = b"foo" * 100
+        m.enqueue(
+            LocalFileHeader._for_testing(usize=len(d), filename="foo/bar.py"),
+            WrappedFile(io.BytesIO(d)),
+        )
 
-            item = m._queue.get()
-            assert isinstance(item, QueueItem)
+        item = m._queue.get()
+        assert isinstance(item, QueueItem)
 
-            self.assertTrue(m._queue.empty())
-            self.assertEqual("foo/bar.py", item.partial_lfh.filename)
-            self.assertEqual(len(d), item.partial_lfh.usize)
+        self.assertTrue(m._queue.empty())
+        self.assertEqual("foo/bar.py", item.partial_lfh.filename)
+        self.assertEqual(len(d), item.partial_lfh.usize)
 
         self.assertEqual(
             # Not proud of hardcoding the deflate stream here, but this is
@@ -50,19 +52,18 @@ class WZipTest(unittest.TestCase):
 
     def test_compress_explicitly_zstd(self) -> None:
         c = CompressionChooser(default="zstd@compression_level=1")
-        with tempfile.NamedTemporaryFile() as z:
-            m = WZip(filename=Path("foo.zip"), fobj=z.file, chooser=c)
-            m._shutdown()  # so _we_ can read the queue
-            m._consumer_thread.join()
-            d = b"foo" * 100
-            m.enqueue(
-                LocalFileHeader._for_testing(usize=len(d), filename="foo/bar.py"),
-                WrappedFile(io.BytesIO(d)),
-            )
-            item = m._queue.get()
-            assert isinstance(item, QueueItem)
+        m = WZip(
+            filename=Path("foo.zip"), fobj=io.BytesIO(), chooser=c, start_consumer=False
+        )
+        d = b"foo" * 100
+        m.enqueue(
+            LocalFileHeader._for_testing(usize=len(d), filename="foo/bar.py"),
+            WrappedFile(io.BytesIO(d)),
+        )
+        item = m._queue.get()
+        assert isinstance(item, QueueItem)
 
-            self.assertTrue(m._queue.empty())
+        self.assertTrue(m._queue.empty())
 
         self.assertEqual("foo/bar.py", item.partial_lfh.filename)
         self.assertEqual(len(d), item.partial_lfh.usize)
@@ -84,3 +85,137 @@ class WZipTest(unittest.TestCase):
         zf = zipfile.ZipFile(b)
         # TODO interrogate the zf to make sure it _was_ zip64
         self.assertEqual(20, len(zf.namelist()))
+
+    def test_rwrite_dir(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            root = Path(d)
+            (root / "a" / "b").mkdir(parents=True)
+            (root / "top.txt").write_bytes(b"top")
+            (root / "a" / "b" / "deep.txt").write_bytes(b"deep")
+
+            b = io.BytesIO()
+            with WZip(Path("foo.zip"), fobj=b) as z:
+                z.rwrite(root)
+            zf = zipfile.ZipFile(b)
+            self.assertEqual(
+                ["deep.txt", "top.txt"],
+                sorted(Path(n).name for n in zf.namelist()),
+            )
+            self.assertIsNone(zf.testzip())
+
+    def test_shared_executor(self) -> None:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for _ in range(2):
+                b = io.BytesIO()
+                with WZip(Path("foo.zip"), fobj=b, executor=pool) as z:
+                    z.enqueue(
+                        LocalFileHeader._for_testing(usize=3, filename="a.txt"),
+                        WrappedFile(io.BytesIO(b"abc")),
+                    )
+                self.assertEqual(b"abc", zipfile.ZipFile(b).read("a.txt"))
+            # Still usable, only the pools WZip made are shut down
+            self.assertEqual(1, pool.submit(int, "1").result())
+
+    def test_precompressed_file_budget(self) -> None:
+        b = io.BytesIO()
+        # Precompressed entries take (and give back) a slot too, so with one
+        # slot these all have to go through in turn.
+        with WZip(Path("foo.zip"), fobj=b, file_budget=1) as z:
+            for i in range(3):
+                lfh = LocalFileHeader._for_testing(usize=3, filename=f"{i}.txt")
+                lfh.csize = 3
+                lfh.crc32 = zlib.crc32(b"abc")
+                z.enqueue_precompressed(lfh, b"", b"abc")
+                z.write(Path(f"w{i}.txt"), fobj=io.BytesIO(b"def"))
+        zf = zipfile.ZipFile(b)
+        self.assertEqual(6, len(zf.namelist()))
+        self.assertIsNone(zf.testzip())
+        self.assertEqual(1, z._file_budget._value)
+
+    def test_multi_block(self) -> None:
+        data = os.urandom(3 * 1024 * 1024 + 5)
+        # Held and written once with the real header, and with the header
+        # patched afterwards
+        for max_held in (fastzip.write.MAX_HELD_BYTES, 0):
+            with mock.patch("fastzip.write.MAX_HELD_BYTES", max_held):
+                with tempfile.TemporaryDirectory() as d:
+                    # Our own file (pwrite) and one we're given (seek)
+                    path = Path(d, "foo.zip")
+                    for fobj in (None, io.BytesIO()):
+                        with WZip(path, fobj=fobj) as z:
+                            z.write(Path("a"), fobj=io.BytesIO(data))
+                            z.write(Path("b"), fobj=io.BytesIO(b"b"))
+                        zf = zipfile.ZipFile(fobj or path)
+                        self.assertIsNone(zf.testzip())
+                        self.assertEqual(data, zf.read("a"))
+
+    def test_unknown_deflate_backend(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d, "foo.zip")
+            with mock.patch("fastzip.algo.deflate.DEFLATE_BACKEND", "bogus"):
+                with self.assertRaises(ValueError):
+                    WZip(path)
+            self.assertFalse(path.exists())
+
+    def test_enqueue_error(self) -> None:
+        with mock.patch(
+            "fastzip.algo.deflate.DeflateCompressor.compress_to_futures",
+            side_effect=RuntimeError("boom"),
+        ):
+            # Used to kill the open consumer, and hang here
+            with WZip(Path("foo.zip"), fobj=io.BytesIO(), file_budget=1) as z:
+                z.write(Path("a"), fobj=io.BytesIO(b"a" * 100))
+                z.write(Path("b"), fobj=io.BytesIO(b"b"))
+        self.assertIsInstance(z._exc, RuntimeError)
+
+    def test_block_error_waits_for_other_blocks(self) -> None:
+        events = []
+        compress_block = DeflateCompressor._compress_block
+        exit = WrappedFile.__exit__
+
+        def _compress_block(self: DeflateCompressor, *args: Any) -> Any:
+            if args[2] == 0:
+                # The empty file, compressed up front
+                return compress_block(self, *args)
+            elif args[1] == 0:
+                raise RuntimeError("boom")
+            time.sleep(0.05)
+            events.append("block")
+            return compress_block(self, *args)
+
+        def __exit__(self: WrappedFile, *args: Any) -> None:
+            events.append("exit")
+            exit(self, *args)
+
+        with mock.patch(
+            "fastzip.algo.deflate.THREAD_BLOCK_SIZE", 64 * 1024
+        ), mock.patch.object(
+            DeflateCompressor, "_compress_block", _compress_block
+        ), mock.patch.object(
+            WrappedFile, "__exit__", __exit__
+        ):
+            with tempfile.TemporaryDirectory() as d:
+                # Small enough to be read into a pooled buffer
+                src = Path(d, "a")
+                src.write_bytes(os.urandom(256 * 1024))
+                with WZip(Path(d, "foo.zip")) as z:
+                    z.write(src, archive_path=Path("a"))
+                    z.write(Path("b"), fobj=io.BytesIO(b"b"))
+        self.assertIsInstance(z._exc, RuntimeError)
+        # "a" wasn't closed until all its blocks were done
+        self.assertEqual(["block"] * 3 + ["exit"] * 2, events)
+
+    def test_store_multi_block(self) -> None:
+        # Big enough to be mmapped
+        data = os.urandom(1536 * 1024 + 5)
+        with mock.patch("fastzip.algo.store.THREAD_BLOCK_SIZE", 256 * 1024):
+            with tempfile.TemporaryDirectory() as d:
+                src = Path(d, "a")
+                src.write_bytes(data)
+                path = Path(d, "foo.zip")
+                with WZip(path, chooser=CompressionChooser(default="store")) as z:
+                    z.write(src, archive_path=Path("a"))
+                zf = zipfile.ZipFile(path)
+                self.assertEqual(zipfile.ZIP_STORED, zf.getinfo("a").compress_type)
+                self.assertIsNone(zf.testzip())
+                self.assertEqual(data, zf.read("a"))
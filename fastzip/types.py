@@ -1,11 +1,15 @@
+import codecs
+import functools
+import math
 import os
 import struct
+import sys
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import IO, List, Optional, Sequence, Tuple, TYPE_CHECKING
+from typing import Any, Dict, IO, List, Optional, Sequence, Tuple, TYPE_CHECKING
 
-from keke import kev
+from ._kev import kev
 
 from .util import _readn, _slicen
 
@@ -13,11 +17,16 @@ if TYPE_CHECKING:
     from .algo._wrapfile import WrappedFile
 
 
+# Where available, slots drop the per-instance __dict__; the writer keeps a
+# LocalFileHeader for every entry until it writes the central directory.
+_SLOTS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
 class EndOfLocalFiles(Exception):
     pass
 
 
-class BadLocalFileSignature(Exception):
+class BadLocalFileSignature(ValueError):
     pass
 
 
@@ -29,11 +38,78 @@ FLAG_FILENAME_UTF8 = 1 << 11
 
 LOCAL_FILE_HEADER_SIGNATURE = 0x04034B50
 LOCAL_FILE_HEADER_FORMAT = "<LHHHHHLLLHH"
+_LFH_STRUCT = struct.Struct(LOCAL_FILE_HEADER_FORMAT)
+_LFH_SIGNATURE_BYTES = LOCAL_FILE_HEADER_SIGNATURE.to_bytes(4, "little")
+
+# The (id, size) header of each extra field
+_EXTRA_HEADER_STRUCT = struct.Struct("<HH")
+# A whole zip64 extra for a LFH: the header, then usize and csize
+_ZIP64_LFH_EXTRA_STRUCT = struct.Struct("<HHQQ")
+# `_UINT64_STRUCTS[n]` is n little-endian 8-byte values, for zip64 extras that
+# only carry some of the fields.
+_UINT64_STRUCTS = [struct.Struct("<%dQ" % n) for n in range(4)]
+
+
+def _unpack_uint64s(data: bytes) -> List[int]:
+    """
+    Returns the whole 8-byte little-endian values in `data` (ignoring any
+    partial one at the end), with a single unpack.
+    """
+    n = len(data) // 8
+    if n < len(_UINT64_STRUCTS):
+        return list(_UINT64_STRUCTS[n].unpack_from(data))
+    return list(struct.unpack_from("<%dQ" % n, data))
+
 
 WILL_BE_REPLACED_VALUE = 0xFF112233
 
 
-@dataclass
+@functools.lru_cache(maxsize=4096)
+def _dos_date_time(mtime: int) -> Tuple[int, int]:
+    """
+    Returns `(dosdate, dostime)` for a unix time in whole seconds.
+
+    Cached because localtime() is ~0.7us, and files created together (say, by
+    a checkout or an extract) tend to share their mtime.
+    """
+    dt = time.localtime(mtime)
+    # These two lines come verbatim from cpython's zipfile.py but are
+    # likely the only way to do this numeric conversion.
+    dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+    dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+    return dosdate, dostime
+
+
+# Unlike utf-8 and ascii, decode("cp437") goes through the codec registry on
+# every call, which is most of its cost.
+_CP437_DECODE = codecs.getdecoder("cp437")
+
+
+def _decode_filename(data: bytes, flags: int) -> str:
+    """
+    Decodes a filename (or comment) from a header with the given flags.
+    """
+    if flags & FLAG_FILENAME_UTF8:
+        return data.decode("utf-8")  # can raise
+    elif data.isascii():
+        # The usual case, and cp437 is a superset of ascii
+        return data.decode("ascii")
+    else:
+        return _CP437_DECODE(data)[0]
+
+
+def _encode_filename(filename: str) -> Tuple[bytes, int]:
+    """
+    Returns `(encoded, flags)`, where flags has FLAG_FILENAME_UTF8 set if the
+    name isn't plain ascii.
+    """
+    try:
+        return filename.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return filename.encode("utf-8"), FLAG_FILENAME_UTF8
+
+
+@dataclass(**_SLOTS)
 class LocalFileHeader:
     # Section 4.3.7 of APPNOTE.TXT
     signature: int
@@ -45,7 +121,7 @@ class LocalFileHeader:
     crc32: int
     csize: int
     usize: int
-    filename_length: int  # TODO this is unicode length!
+    filename_length: int
     extra_length: int
 
     filename: Optional[str] = None
@@ -66,11 +142,7 @@ class LocalFileHeader:
         mtime = synthetic_mtime if synthetic_mtime is not None else stat.st_mtime
         # TODO this loses a little bit of precision, and someday we probably
         # want to store the higher-resolution unix extra as well.
-        dt = time.localtime(mtime)
-        # These two lines come verbatim from cpython's zipfile.py but are
-        # likely the only way to do this numeric conversion.
-        dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
-        dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+        dosdate, dostime = _dos_date_time(math.floor(mtime))
 
         if filename.anchor:
             # N.b. platform-dependent behavior; this will strip drive letters
@@ -80,21 +152,27 @@ class LocalFileHeader:
 
         with kev("as_posix", __name__):
             filename_str = filename.as_posix()  # '/' normalized value
+        # Only for its length (in bytes, which is what goes on disk) and flag;
+        # dump() encodes from `filename` again, so the two can't disagree if
+        # it's changed in between.
+        fn, flags = _encode_filename(filename_str)
 
         with kev("ret", __name__):
+            # Positional, because the generated __init__ takes ~2us to match up
+            # this many keywords and ~0.7us without.
             return cls(
-                signature=LOCAL_FILE_HEADER_SIGNATURE,
-                version_needed=2,
-                flags=0,  # (mode & 0o777) << 8,  # TODO assumes not a dir
-                method=0,
-                mtime=dostime,
-                mdate=dosdate,
-                crc32=WILL_BE_REPLACED_VALUE,
-                csize=WILL_BE_REPLACED_VALUE,
-                usize=stat.st_size,
-                filename_length=len(filename_str),
-                extra_length=0,  # TODO unix extra, zip64 extra
-                filename=filename_str,
+                LOCAL_FILE_HEADER_SIGNATURE,  # signature
+                2,  # version_needed
+                flags,  # (mode & 0o777) << 8,  # TODO assumes not a dir
+                0,  # method
+                dostime,  # mtime
+                dosdate,  # mdate
+                WILL_BE_REPLACED_VALUE,  # crc32
+                WILL_BE_REPLACED_VALUE,  # csize
+                stat.st_size,  # usize
+                len(fn),  # filename_length
+                0,  # extra_length; TODO unix extra, zip64 extra
+                filename_str,  # filename
             )
 
     @classmethod
@@ -135,24 +213,26 @@ class LocalFileHeader:
         be reset and BadLocalFileSignature will be raised.  This is an abnormal
         case and one that does not conform to zip-the-good-parts.
         """
-        buf = _readn(fo, struct.calcsize(LOCAL_FILE_HEADER_FORMAT))
-        args = struct.unpack(LOCAL_FILE_HEADER_FORMAT, buf)
-        inst = cls(*args)
-        assert inst.crc32 is not None
-
-        if inst.signature == CENTRAL_DIRECTORY_SIGNATURE:
+        buf = _readn(fo, _LFH_STRUCT.size)
+        # Checked before unpacking the rest, which is wasted work on the
+        # central directory header that ends every zip.
+        sig = buf[:4]
+        if sig != _LFH_SIGNATURE_BYTES:
             fo.seek(-len(buf), os.SEEK_CUR)
-            raise EndOfLocalFiles()
-        if inst.signature != LOCAL_FILE_HEADER_SIGNATURE:
-            raise ValueError("Invalid signature %0x" % (inst.signature,))
+            if sig == _CDH_SIGNATURE_BYTES:
+                raise EndOfLocalFiles()
+            raise BadLocalFileSignature(
+                "Invalid signature %0x" % (int.from_bytes(sig, "little"),)
+            )
+        inst = cls(*_LFH_STRUCT.unpack(buf))
 
-        filename_data = _readn(fo, inst.filename_length)
-        buf += filename_data
+        # The filename and extra are read (and appended to buf) together, rather
+        # than each one making a new copy of everything before it.
+        rest = _readn(fo, inst.filename_length + inst.extra_length)
+        buf += rest
+        filename_data = rest[: inst.filename_length]
 
-        if inst.flags & FLAG_FILENAME_UTF8:
-            inst.filename = filename_data.decode("utf-8")  # can raise
-        else:
-            inst.filename = filename_data.decode("cp437")
+        inst.filename = _decode_filename(filename_data, inst.flags)
 
         if inst.flags & FLAG_DATA_DESCRIPTOR:
             # I am not a fan of the complexity and additional validation
@@ -163,19 +243,16 @@ class LocalFileHeader:
 
         if inst.extra_length:
             extra: List[Tuple[int, bytes]] = []
-            extra_data = _readn(fo, inst.extra_length)
+            extra_data = rest[inst.filename_length :]
             # print(" ".join("%02x" % c for c in extra_data))
 
             i = 0
-            # The len() - 4 is to avoid `_slicen` needing to raise an exception
-            # if there are 1-3 bytes left.  We raise that exception ourselves
+            # The len() - 4 is to avoid `unpack_from` needing to raise an
+            # exception if there are 1-3 bytes left.  We raise that exception ourselves
             # directly below the loop to make it more clear that it's leftover
             # data at the _end_ rather than one that is completely malformed.
             while i < len(extra_data) - 4:
-                extra_id, data_size = struct.unpack(
-                    "<HH",
-                    _slicen(extra_data, i, 4),
-                )
+                extra_id, data_size = _EXTRA_HEADER_STRUCT.unpack_from(extra_data, i)
                 # print("Extra", i, extra_id, data_size)
                 i += 4
                 data = _slicen(extra_data, i, data_size)
@@ -183,10 +260,7 @@ class LocalFileHeader:
                 extra.append((extra_id, data))
 
                 if extra_id == 1:  # zip64 entry
-                    sizes = [
-                        int.from_bytes(data[n : n + 8], "little")
-                        for n in range(0, len(data), 8)
-                    ]
+                    sizes = _unpack_uint64s(data)
                     if inst.usize == UINT32_MAX:
                         inst.usize = sizes.pop(0)
                     if inst.csize == UINT32_MAX:
@@ -195,12 +269,11 @@ class LocalFileHeader:
                     # few places that APPNOTE.TXT uses the modern word "MUST" --
                     # and both "disk" and "header offset" can't exist in the
                     # LFH.
-                    if len(sizes) != 0:
+                    if len(sizes) != 0 or len(data) % 8:
                         raise ValueError("Extra zip64 extra in LFH")
             if i != len(extra_data):
                 raise ValueError("Extra length")
             inst.parsed_extra = tuple(extra)
-            buf += extra_data
 
         return inst, buf
 
@@ -216,29 +289,34 @@ class LocalFileHeader:
     def dump(self) -> Tuple[bytes, int]:
         flags = self.flags
         assert self.filename is not None
-        try:
-            fn = self.filename.encode("ascii")
-            # If utf-8 is already set, leave it?
-        except UnicodeEncodeError:
-            fn = self.filename.encode("utf-8")
-            flags |= FLAG_FILENAME_UTF8
+        fn, utf8_flag = _encode_filename(self.filename)
+        # If utf-8 is already set, leave it?
+        flags |= utf8_flag
 
         usize = self.usize
         csize = self.csize
         min_ver = self.version_needed
-        if self.usize >= UINT32_MAX or self.csize >= UINT32_MAX:
-            zip64_extra = struct.pack("<QQ", self.usize, self.csize)
+        zip64 = usize >= UINT32_MAX or csize >= UINT32_MAX
+        # Nearly every header we write has no extras at all, so this avoids
+        # running the join for them.
+        if self.parsed_extra:
+            extra = b"".join(
+                _EXTRA_HEADER_STRUCT.pack(i, len(v)) + v
+                for i, v in self.parsed_extra
+                if not (zip64 and i == 1)
+            )
+        else:
+            extra = b""
+        if zip64:
+            # Equivalent to replace_extra(1, ...), without modifying self (and
+            # this is called twice for big files).
+            extra += _ZIP64_LFH_EXTRA_STRUCT.pack(1, 16, usize, csize)
             usize = UINT32_MAX
             csize = UINT32_MAX
-            self.replace_extra(1, zip64_extra)
             min_ver = max(self.version_needed, ZIP64_VERSION)
-        extra = b"".join(
-            struct.pack("<HH", i[0], len(i[1])) + i[1] for i in self.parsed_extra
-        )
         extra_length = len(extra)
         return (
-            struct.pack(
-                LOCAL_FILE_HEADER_FORMAT,
+            _LFH_STRUCT.pack(
                 self.signature,
                 min_ver,
                 flags,
@@ -257,10 +335,12 @@ class LocalFileHeader:
 
 
 CENTRAL_DIRECTORY_FORMAT = "<LHHHHHHLLLHHHHHLL"
+_CDH_STRUCT = struct.Struct(CENTRAL_DIRECTORY_FORMAT)
 CENTRAL_DIRECTORY_SIGNATURE = 0x02014B50
+_CDH_SIGNATURE_BYTES = CENTRAL_DIRECTORY_SIGNATURE.to_bytes(4, "little")
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class CentralDirectoryHeader:
     # Section 4.3.12 of APPNOTE.TXT
     signature: int
@@ -273,7 +353,7 @@ class CentralDirectoryHeader:
     crc32: int
     csize: int
     usize: int
-    filename_length: int  # TODO this is unicode length!
+    filename_length: int
     extra_length: int
     comment_length: int  # Not in LFH
 
@@ -290,74 +370,146 @@ class CentralDirectoryHeader:
     def from_lfh_and_relative_offset(
         cls, lfh: LocalFileHeader, offset: int
     ) -> "CentralDirectoryHeader":
+        # Positional for the same reason as in LocalFileHeader.from_wrapped_file;
+        # this runs once per entry.
         return cls(
-            signature=CENTRAL_DIRECTORY_SIGNATURE,
-            version_made_by=0,  # TODO
-            version_needed=lfh.version_needed,
-            flags=lfh.flags,
-            method=lfh.method,
-            mtime=lfh.mtime,
-            mdate=lfh.mdate,
-            crc32=lfh.crc32,
-            csize=lfh.csize,
-            usize=lfh.usize,
-            filename_length=lfh.filename_length,  # TODO verify?
-            extra_length=lfh.extra_length,  # TODO
-            comment_length=0,  # TODO be able to set?
-            disk_start=0,  # We only want to support single-disk archives
-            internal_attributes=0,  # TODO WUT
-            external_attributes=0,
-            relative_offset_of_lfh=offset,
-            filename=lfh.filename,  # TODO ordering
+            CENTRAL_DIRECTORY_SIGNATURE,  # signature
+            0,  # version_made_by; TODO
+            lfh.version_needed,  # version_needed
+            lfh.flags,  # flags
+            lfh.method,  # method
+            lfh.mtime,  # mtime
+            lfh.mdate,  # mdate
+            lfh.crc32,  # crc32
+            lfh.csize,  # csize
+            lfh.usize,  # usize
+            lfh.filename_length,  # filename_length; TODO verify?
+            lfh.extra_length,  # extra_length; TODO
+            0,  # comment_length; TODO be able to set?
+            0,  # disk_start; we only want to support single-disk archives
+            0,  # internal_attributes; TODO WUT
+            0,  # external_attributes
+            offset,  # relative_offset_of_lfh
+            lfh.filename,  # filename; TODO ordering
         )
 
+    @classmethod
+    def unpack_from(
+        cls, buf: bytes, offset: int
+    ) -> Tuple["CentralDirectoryHeader", int]:
+        """
+        Parses the header at `offset` in `buf` (typically the whole central
+        directory), returning `(object, offset_of_next_header)`.
+
+        Sizes and the local file header offset are taken from the zip64 extra
+        when the fixed fields say to.
+        """
+        args = _CDH_STRUCT.unpack_from(buf, offset)
+        inst = cls(*args)
+        if inst.signature != CENTRAL_DIRECTORY_SIGNATURE:
+            raise ValueError("Invalid signature %0x" % (inst.signature,))
+        pos = offset + _CDH_STRUCT.size
+
+        filename_data = _slicen(buf, pos, inst.filename_length)
+        pos += inst.filename_length
+        inst.filename = _decode_filename(filename_data, inst.flags)
+
+        extra_data = _slicen(buf, pos, inst.extra_length)
+        pos += inst.extra_length
+        extra: List[Tuple[int, bytes]] = []
+        i = 0
+        while i <= len(extra_data) - 4:
+            extra_id, data_size = _EXTRA_HEADER_STRUCT.unpack_from(extra_data, i)
+            i += 4
+            data = _slicen(extra_data, i, data_size)
+            i += data_size
+            extra.append((extra_id, data))
+
+            if extra_id == 1:  # zip64 entry
+                # Section 4.5.3; only the fields that overflowed are present, in
+                # this order (the trailing disk number is 4 bytes, and ignored).
+                values = _unpack_uint64s(data)
+                if inst.usize == UINT32_MAX:
+                    inst.usize = values.pop(0)
+                if inst.csize == UINT32_MAX:
+                    inst.csize = values.pop(0)
+                if inst.relative_offset_of_lfh == UINT32_MAX:
+                    inst.relative_offset_of_lfh = values.pop(0)
+        if i != len(extra_data):
+            raise ValueError("Extra length")
+        inst.parsed_extra = tuple(extra)
+
+        comment_data = _slicen(buf, pos, inst.comment_length)
+        pos += inst.comment_length
+        inst.file_comment = _decode_filename(comment_data, inst.flags)
+        return inst, pos
+
     # TODO not happy with the name
     def dump(self) -> bytes:
         flags = self.flags
 
         assert self.filename is not None
-        try:
-            fn = self.filename.encode("ascii")
-            # If utf-8 is already set, leave it?
-        except UnicodeEncodeError:
-            fn = self.filename.encode("utf-8")
-            flags |= FLAG_FILENAME_UTF8
-        # TODO dump these too, they're important
-        extra = b""
-        comment = b""
+        fn, utf8_flag = _encode_filename(self.filename)
+        # If utf-8 is already set, leave it?
+        flags |= utf8_flag
+
+        usize = self.usize
+        csize = self.csize
+        offset = self.relative_offset_of_lfh
+        version_needed = self.version_needed
+        # Section 4.5.3; only the fields that overflowed go in the zip64
+        # extra, in this order.
+        zip64_values: List[int] = []
+        if usize >= UINT32_MAX:
+            zip64_values.append(usize)
+            usize = UINT32_MAX
+        if csize >= UINT32_MAX:
+            zip64_values.append(csize)
+            csize = UINT32_MAX
+        if offset >= UINT32_MAX:
+            zip64_values.append(offset)
+            offset = UINT32_MAX
+        if zip64_values:
+            extra = _EXTRA_HEADER_STRUCT.pack(
+                1, 8 * len(zip64_values)
+            ) + _UINT64_STRUCTS[len(zip64_values)].pack(*zip64_values)
+            version_needed = max(version_needed, ZIP64_VERSION)
+        else:
+            # TODO dump parsed_extra too
+            extra = b""
+        # TODO comment; until then there's nothing to append after the extra
         return (
-            struct.pack(
-                CENTRAL_DIRECTORY_FORMAT,
+            _CDH_STRUCT.pack(
                 self.signature,
                 self.version_made_by,
-                self.version_needed,
+                version_needed,
                 flags,
                 self.method,
                 self.mtime,
                 self.mdate,
                 self.crc32,
-                self.csize,
-                self.usize,
+                csize,
+                usize,
                 # TODO always recalculates filename length, I guess?
                 len(fn),
-                0,  # TODO extra_length
+                len(extra),
                 0,  # TODO comment_length
                 self.disk_start,
                 self.internal_attributes,
                 self.external_attributes,
-                self.relative_offset_of_lfh,
+                offset,
             )
             + fn
             + extra
-            + comment
         )
 
 
 ZIP64_EOCD_FORMAT = "<LQHHLLQQQQ"
+_ZIP64_EOCD_STRUCT = struct.Struct(ZIP64_EOCD_FORMAT)
 ZIP64_EOCD_SIGNATURE = 0x06064B50
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class Zip64EOCD:
     signature: int
     size: int
@@ -373,10 +525,9 @@ class Zip64EOCD:
 
     def dump(self) -> bytes:
         # Spec says to do this, whatev
-        size = struct.calcsize(ZIP64_EOCD_FORMAT) + len(self.extensible_data) - 12
+        size = _ZIP64_EOCD_STRUCT.size + len(self.extensible_data) - 12
         return (
-            struct.pack(
-                ZIP64_EOCD_FORMAT,
+            _ZIP64_EOCD_STRUCT.pack(
                 self.signature,
                 size,
                 self.version_made_by,
@@ -393,10 +544,11 @@ class Zip64EOCD:
 
 
 ZIP64_EOCD_LOCATOR_FORMAT = "<LLQL"
+_ZIP64_EOCD_LOCATOR_STRUCT = struct.Struct(ZIP64_EOCD_LOCATOR_FORMAT)
 ZIP64_EOCD_LOCATOR_SIGNATURE = 0x07064B50
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class Zip64EOCDLocator:
     signature: int
     disk_with_start: int
@@ -404,8 +556,7 @@ class Zip64EOCDLocator:
     total_disks: int
 
     def dump(self) -> bytes:
-        return struct.pack(
-            ZIP64_EOCD_LOCATOR_FORMAT,
+        return _ZIP64_EOCD_LOCATOR_STRUCT.pack(
             self.signature,
             self.disk_with_start,
             self.relative_offset,
@@ -414,10 +565,11 @@ class Zip64EOCDLocator:
 
 
 EOCD_FORMAT = "<LHHHHLLH"
+_EOCD_STRUCT = struct.Struct(EOCD_FORMAT)
 EOCD_SIGNATURE = 0x06054B50
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class EOCD:
     signature: int
     disk_num: int
@@ -434,8 +586,7 @@ class EOCD:
         # super useful, so restrict to ascii for now.
         comment_bytes = self.comment.encode("ascii")
         return (
-            struct.pack(
-                EOCD_FORMAT,
+            _EOCD_STRUCT.pack(
                 self.signature,
                 self.disk_num,
                 self.disk_with_start,
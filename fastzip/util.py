@@ -1,3 +1,4 @@
+import os
 from typing import IO
 
 
@@ -13,3 +14,10 @@ def _slicen(buf: bytes, off: int, n: int) -> bytes:
     if len(data) != n:
         raise ValueError(f"Short read: wanted {n} but got {len(data)}")
     return data
+
+
+def _preadn(fd: int, n: int, offset: int) -> bytes:
+    data = os.pread(fd, n, offset)
+    if len(data) != n:
+        raise ValueError(f"Short read: wanted {n} but got {len(data)}")
+    return data
@@ -6,19 +6,19 @@ import os
 import threading
 import time
 import traceback
-from concurrent.futures import Future, ThreadPoolExecutor
-from contextlib import ExitStack
-from dataclasses import replace
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
 from queue import SimpleQueue
 from typing import Any, BinaryIO, Dict, IO, List, Optional, Tuple, Union
 
-from keke import get_tracer, kcount, kev
+from keke import get_tracer, kcount
 
-from ._crc32_combine import crc32_combine
+from ._crc32_combine import crc32_combine_many
+
+from ._kev import kev
 
 from .algo import find_compressor_cls
-from .algo._base import BaseCompressor
+from .algo._base import BaseCompressor, CompressedChunk
 from .algo._queue import QueueItem
 from .algo._wrapfile import WrappedFile
 from .chooser import CompressionChooser, DEFAULT_CHOOSER
@@ -34,11 +34,22 @@ from .types import (
     Zip64EOCDLocator,
 )
 
+from .util import _preadn
+
 MAX_UINT16 = 0xFFFF
 MAX_UINT32 = 0xFFFF_FFFF
 
 DEFAULT_IO_THREADS = 4
 DEFAULT_FILE_BUDGET = 200
+DEFAULT_OUTPUT_BUFFER_SIZE = 1024 * 1024  # Python's default is ~8KiB
+# Multi-block entries with up to this much compressed data are written in one
+# pass, rather than with a provisional header that's patched afterwards.
+MAX_HELD_BYTES = 8 * 1024 * 1024
+
+# When tracing, how often (in seconds) _stats samples the queues, and every
+# how many of those it also records rates.
+STATS_TICK = 0.01
+STATS_RATE_TICKS = 20
 
 LOG = logging.getLogger(__name__)
 
@@ -51,7 +62,8 @@ SHUTDOWN_SENTINEL = _Sentinel()
 
 
 class WZip:
-    _central_directory: List[Tuple[int, LocalFileHeader]]
+    # The already-dumped CentralDirectoryHeader of each entry
+    _central_directory: List[bytes]
 
     def __init__(
         self,
@@ -65,8 +77,19 @@ class WZip:
         io_threads: Optional[int] = None,
         file_budget: Optional[int] = None,
         force_zip64: bool = False,
+        start_consumer: bool = True,
+        output_buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE,
     ):
         self._filename = filename
+        self._threads: int = threads if threads is not None else os.cpu_count()  # type: ignore
+        self._chooser = chooser
+        self._cache: Dict[str, BaseCompressor] = {}
+        # Before anything is opened or started, so that e.g. a compression
+        # library that isn't installed is an error here, and not one on the
+        # open-consumer thread for the first file that uses it.
+        for name in chooser.compressor_names():
+            self._get_compressor(name).prepare()
+
         if fobj is not None:
             self._fobj = fobj
             self._fobj_provided = True
@@ -74,10 +97,13 @@ class WZip:
             self._fobj = open(
                 filename,
                 "xb",
-                buffering=1024 * 1024,  # XXX Default is ~8KiB
+                buffering=output_buffer_size,
             )  # Do not allow overwriting
             self._fobj_provided = False
-        self._threads: int = threads if threads is not None else os.cpu_count()  # type: ignore
+        # Headers of multi-block entries get rewritten in place; on our own
+        # file (so it's a real one, and not opened for append) that can be a
+        # pwrite instead of seeking away and back.
+        self._use_pwrite = not self._fobj_provided and hasattr(os, "pwrite")
         _file_budget: int = (
             file_budget if file_budget is not None else DEFAULT_FILE_BUDGET
         )
@@ -88,6 +114,9 @@ class WZip:
             Union[QueueItem, Future[Tuple[LocalFileHeader, WrappedFile]], _Sentinel]
         ] = SimpleQueue()
         self._queue: SimpleQueue[Union[QueueItem, _Sentinel]] = SimpleQueue()
+        # Every compressor submits into this one pool; pass `executor` to also
+        # share it between several WZip.
+        self._executor_provided = executor is not None
         self._executor = (
             executor
             if executor is not None
@@ -100,9 +129,6 @@ class WZip:
             max_workers=_io_threads, thread_name_prefix="IO"
         )
 
-        self._chooser = chooser
-        self._cache: Dict[str, BaseCompressor] = {}
-
         self._bytes_written = 0
         if prefix_data:
             self._fobj.write(prefix_data)
@@ -113,9 +139,13 @@ class WZip:
         self._central_directory = []
         self._central_directory_min_ver = 0
         self._open_consumer_thread = threading.Thread(target=self._open_consumer)
-        self._open_consumer_thread.start()
         self._consumer_thread = threading.Thread(target=self._consumer)
-        self._consumer_thread.start()
+        # Without the consumers nothing gets written, and this can't be
+        # exited; that's only useful to tests (or benchmarks) that want to
+        # read what enqueue() put on `_queue`.
+        if start_consumer:
+            self._open_consumer_thread.start()
+            self._consumer_thread.start()
         self._done = False
         self._stats_thread: Optional[threading.Thread] = None
         self._force_zip64 = force_zip64
@@ -140,6 +170,11 @@ class WZip:
             self._fobj.flush()
         with kev("io_executor.shutdown"):
             self._io_executor.shutdown()
+        if not self._executor_provided:
+            # Otherwise its idle threads stick around until interpreter exit,
+            # one pool's worth per WZip.
+            with kev("executor.shutdown"):
+                self._executor.shutdown()
         with kev("_write_central_dir"):
             self._write_central_dir()
         if not self._fobj_provided:
@@ -150,36 +185,49 @@ class WZip:
             self._stats_thread.join()
 
     def _stats(self) -> None:
+        # Queue depths are sampled every tick, but only emitted when they
+        # change; the rates (and the fd count, which costs a listdir) only
+        # every STATS_RATE_TICKS.  Each kcount is an event in the trace.
         prev_ts = None
         prev_process_time = None
         prev_bytes_written = None
+        prev_depths: Dict[str, int] = {}
+        tick = 0
         while not self._done:
-            kcount("open_queue", self._open_queue.qsize())
-            kcount("queue", self._queue.qsize())
-            kcount("futures", self._executor._work_queue.qsize())
-            kcount("io_futures", self._io_executor._work_queue.qsize())
-            kcount("file_budget", self._file_budget._value)
-
-            ts = time.time()
-            process_time = time.process_time()
-            bytes_written = self._bytes_written
-            if prev_ts is not None:
-                kcount(
-                    "proc_cpu_pct",
-                    100 * (process_time - prev_process_time) / (ts - prev_ts),
-                )
-                kcount(
-                    "kB_written_per_sec",
-                    (bytes_written - prev_bytes_written) / (ts - prev_ts) / 1000,
-                )
-            prev_ts = ts
-            prev_process_time = process_time
-            prev_bytes_written = bytes_written
-
-            # TODO linux-only
-            kcount("fds", len(os.listdir("/proc/self/fd")))
-
-            time.sleep(0.01)
+            depths = {
+                "open_queue": self._open_queue.qsize(),
+                "queue": self._queue.qsize(),
+                "futures": self._executor._work_queue.qsize(),
+                "io_futures": self._io_executor._work_queue.qsize(),
+                "file_budget": self._file_budget._value,
+            }
+            for name, value in depths.items():
+                if prev_depths.get(name) != value:
+                    kcount(name, value)
+            prev_depths = depths
+
+            if tick % STATS_RATE_TICKS == 0:
+                ts = time.time()
+                process_time = time.process_time()
+                bytes_written = self._bytes_written
+                if prev_ts is not None:
+                    kcount(
+                        "proc_cpu_pct",
+                        100 * (process_time - prev_process_time) / (ts - prev_ts),
+                    )
+                    kcount(
+                        "kB_written_per_sec",
+                        (bytes_written - prev_bytes_written) / (ts - prev_ts) / 1000,
+                    )
+                prev_ts = ts
+                prev_process_time = process_time
+                prev_bytes_written = bytes_written
+
+                if os.path.isdir("/proc/self/fd"):  # linux-only
+                    kcount("fds", len(os.listdir("/proc/self/fd")))
+
+            tick += 1
+            time.sleep(STATS_TICK)
 
     def _shutdown(self) -> None:
         self._open_queue.put(SHUTDOWN_SENTINEL)
@@ -192,12 +240,23 @@ class WZip:
         reasonable exceptions in the main thread.
         """
         if local_path.is_dir():
-            for p in local_path.iterdir():
-                self.rwrite(p)
+            self._rwrite_dir(local_path)
         else:
             assert os.access(local_path, os.R_OK)
             self.write(local_path)
 
+    def _rwrite_dir(self, local_path: Path) -> None:
+        # scandir gets the file type from readdir on most platforms, so unlike
+        # Path.is_dir() on each child this doesn't need a stat per entry.
+        with os.scandir(local_path) as it:
+            for entry in it:
+                p = local_path / entry.name
+                if entry.is_dir():
+                    self._rwrite_dir(p)
+                else:
+                    assert os.access(entry.path, os.R_OK)
+                    self.write(p)
+
     def _write_open(
         self,
         fobj: Optional[BinaryIO],
@@ -207,16 +266,15 @@ class WZip:
         f: BinaryIO
         with kev("open", __name__, path=local_path.as_posix()):
             if fobj is None:
-                f = open(local_path, "rb")
+                # Unbuffered, since the data is only ever mmapped or read in
+                # one go; a BufferedReader would be allocated for nothing.
+                f = open(local_path, "rb", buffering=0)
             else:
                 f = fobj
 
             wf = WrappedFile(f)
         with kev("lfh"):
-            lfh = LocalFileHeader.from_wrapped_file(
-                (archive_path if archive_path is not None else local_path),
-                wf,
-            )
+            lfh = LocalFileHeader.from_wrapped_file(archive_path, wf)
         with kev("mmapwrapper"):
             wf.mmapwrapper()
 
@@ -237,16 +295,25 @@ class WZip:
             # Acquisition needs to be in order
             self._file_budget.acquire()
 
-        with kev("fut", "open_queue"):
-            # TODO figure out how to display this as an idle stall
-            fut = self._io_executor.submit(
-                self._write_open,
-                fobj,
-                local_path,
-                # TODO this line is duplicated twice, and is a little questionable to begin with.
-                (archive_path if archive_path is not None else local_path),
-            )
+        if archive_path is None:
+            archive_path = local_path
+
+        fut: Future[Tuple[LocalFileHeader, WrappedFile]]
         with kev("put", "open_queue"):
+            if isinstance(fobj, io.BytesIO):
+                # There's nothing to open or read, so skip the trip through
+                # the IO pool.  Errors still surface via the future, as they
+                # would from there.
+                fut = Future()
+                try:
+                    fut.set_result(self._write_open(fobj, local_path, archive_path))
+                except Exception as e:
+                    fut.set_exception(e)
+            else:
+                # TODO figure out how to display this as an idle stall
+                fut = self._io_executor.submit(
+                    self._write_open, fobj, local_path, archive_path
+                )
             self._open_queue.put(fut)
 
     def enqueue_precompressed(
@@ -258,6 +325,10 @@ class WZip:
         # TODO: note the extra_bytes are not currently used; we make the lfh
         # reconstruct them (unnecessarily), as well as funnel this through the
         # open_queue (to ensure it remains properly ordered).
+        with kev("acquire", "file_budget"):
+            # The consumer releases this like for any other entry, and it keeps
+            # a caller from queueing up a whole archive's worth of data.
+            self._file_budget.acquire()
         self._open_queue.put(
             QueueItem(
                 lfh,
@@ -266,23 +337,42 @@ class WZip:
             )
         )
 
+    def enqueue_precompressed_at(
+        self,
+        lfh: LocalFileHeader,
+        fd: int,
+        offset: int,
+    ) -> None:
+        """
+        Like `enqueue_precompressed` but the `lfh.csize` bytes of compressed
+        data are read from `fd` at `offset` by the IO threads, so that reading
+        overlaps with the caller finding the next entry.
+
+        Requires `os.pread` (i.e. not Windows), and `fd` must stay open until
+        this object is closed.
+
+        Like `write`, this blocks while `file_budget` entries are in flight.
+        """
+        with kev("acquire", "file_budget"):
+            self._file_budget.acquire()
+        self._open_queue.put(
+            QueueItem(
+                lfh,
+                [self._io_executor.submit(_read_precompressed, fd, lfh.csize, offset)],
+                None,
+            )
+        )
+
     def enqueue(self, partial_lfh: LocalFileHeader, file_object: WrappedFile) -> None:
         assert binary_io_check(file_object), f"{file_object} is not binary"
-        LOG.debug("Enqueue %s w/ %s", partial_lfh.filename, repr(file_object))
+        LOG.debug("Enqueue %s w/ %r", partial_lfh.filename, file_object)
 
         with kev("get compressor", __name__):
-            compressor_name = self._chooser._choose_compressor(partial_lfh)
-            if compressor_name in self._cache:
-                obj = self._cache[compressor_name]
-            else:
-                cls, params = find_compressor_cls(compressor_name)
-                obj = cls(self._threads, params)
-                self._cache[compressor_name] = obj
+            obj = self._get_compressor(self._chooser._choose_compressor(partial_lfh))
 
         partial_lfh.method = obj.number
         partial_lfh.version_needed = max(obj.version_needed, partial_lfh.version_needed)
-        exit_stack = ExitStack()
-        exit_stack.enter_context(file_object)
+        file_object.__enter__()
 
         with kev("compress_to_futures", __name__, algo=repr(obj)):
             data_futures = obj.compress_to_futures(
@@ -292,7 +382,21 @@ class WZip:
             )
 
         # TODO figure out how to display this as idle
-        self._queue.put(QueueItem(partial_lfh, data_futures, exit_stack))
+        self._queue.put(QueueItem(partial_lfh, data_futures, file_object))
+
+    def _get_compressor(self, compressor_name: str) -> BaseCompressor:
+        obj = self._cache.get(compressor_name)
+        if obj is None:
+            cls, params = find_compressor_cls(compressor_name)
+            obj = self._cache[compressor_name] = cls(self._threads, params)
+        return obj
+
+    def _add_to_central_directory(self, pos: int, lfh: LocalFileHeader) -> None:
+        # Everything the entry needs is known now, and its bytes are about a
+        # quarter the size of keeping the (pos, lfh) around until the end.
+        self._central_directory.append(
+            CentralDirectoryHeader.from_lfh_and_relative_offset(lfh, pos).dump()
+        )
 
     def _write_central_dir(self) -> None:
         LOG.info("Writing central directory")
@@ -300,17 +404,11 @@ class WZip:
         assert self._central_directory
 
         first_pos = self._fobj.tell()
-        pos = first_pos
-        for abs_offset, lfh in self._central_directory:
-            # print("POS", pos, "ABS_OFFSET", abs_offset)
-            cdh = CentralDirectoryHeader.from_lfh_and_relative_offset(
-                lfh,
-                abs_offset,
-            )
-            data = cdh.dump()
-            self._fobj.write(data)
-            self._bytes_written += len(data)
-            pos += len(data)
+        # Everything through the EOCD is collected here and written as one
+        # piece, rather than with a write() per entry.
+        data = b"".join(self._central_directory)
+        parts = [data]
+        pos = first_pos + len(data)
 
         central_directory_size = pos - first_pos
         num_entries = len(self._central_directory)
@@ -334,23 +432,19 @@ class WZip:
                 central_directory_size,
                 first_pos,
             )
-            self._fobj.write(e64.dump())
+            parts.append(e64.dump())
             l64 = Zip64EOCDLocator(
                 ZIP64_EOCD_LOCATOR_SIGNATURE,
                 0,
                 e64_pos,
                 1,
             )
-            data = l64.dump()
-            self._fobj.write(data)
-            self._bytes_written += len(data)
+            parts.append(l64.dump())
 
-            if num_entries > MAX_UINT16:
-                num_entries = MAX_UINT16
-            if central_directory_size > MAX_UINT32:
-                central_directory_size = MAX_UINT32
-            if first_pos > MAX_UINT32:
-                first_pos = MAX_UINT32
+            # The real values are in the zip64 records; these just say so.
+            num_entries = min(num_entries, MAX_UINT16)
+            central_directory_size = min(central_directory_size, MAX_UINT32)
+            first_pos = min(first_pos, MAX_UINT32)
 
         e = EOCD(
             EOCD_SIGNATURE,
@@ -363,7 +457,8 @@ class WZip:
             0,  # Will get replaced
             self.comment or "",
         )
-        data = e.dump()
+        parts.append(e.dump())
+        data = b"".join(parts)
         self._fobj.write(data)
         self._bytes_written += len(data)
 
@@ -385,11 +480,14 @@ class WZip:
                     self._consumer_many(item)
             # self._queue.task_done()
 
-    def _exit_stack(self, exit_stack: Optional[ExitStack]) -> None:
-        with kev("exit_stack"):
-            if exit_stack:
-                exit_stack.close()
-            self._file_budget.release()
+    def _close_file(self, wrapped_file: Optional[WrappedFile]) -> None:
+        with kev("close_file"):
+            try:
+                if wrapped_file is not None:
+                    wrapped_file.__exit__(None, None, None)
+            finally:
+                # Even if closing failed; otherwise the slot is gone for good.
+                self._file_budget.release()
 
     def _consumer_single(self, item: QueueItem) -> None:
         try:
@@ -397,21 +495,23 @@ class WZip:
                 0
             ].result()
         except Exception as e:
-            self._exit_stack(item.exit_stack)
+            self._close_file(item.wrapped_file)
             self._exc = e
             traceback.print_exc()
             return
 
-        with kev("lfh.replace"):
-            lfh = replace(item.partial_lfh, csize=len(future_data))
-            if future_crc is not None:
-                lfh = replace(lfh, crc32=future_crc)
+        # Filled in on the queued header itself (nothing else holds on to it);
+        # a replace() would build a whole new one per entry.
+        lfh = item.partial_lfh
+        lfh.csize = len(future_data)
+        if future_crc is not None:
+            lfh.crc32 = future_crc
 
         with kev("tell"):
             pos = self._fobj.tell()
 
         with kev("lfh.dump"):
-            self._central_directory.append((pos, lfh))
+            self._add_to_central_directory(pos, lfh)
             new_lfh, min_ver = lfh.dump()
             self._central_directory_min_ver = max(
                 self._central_directory_min_ver, min_ver
@@ -426,16 +526,22 @@ class WZip:
         # raise, and right now nothing will ever see that exception.
         item.compressed_data_futures = ()
         del future_data
-        self._io_executor.submit(self._exit_stack, item.exit_stack)
+        self._io_executor.submit(self._close_file, item.wrapped_file)
 
     def _consumer_many(self, item: QueueItem) -> None:
-        t0 = time.time()
+        # The timings are only for the log line at the end.
+        log_timing = LOG.isEnabledFor(logging.INFO)
+        t0 = time.monotonic() if log_timing else 0.0
         pos = self._fobj.tell()
-        running_crc = None
+        crc_parts: List[Tuple[int, int]] = []
         running_size = 0
-        written_lfh, min_ver = item.partial_lfh.dump()
-        self._central_directory_min_ver = max(self._central_directory_min_ver, min_ver)
-        self._fobj.write(written_lfh)
+        # The first MAX_HELD_BYTES of compressed data are held rather than
+        # written; if the entry ends within that, its header goes out once,
+        # with the real csize and crc, instead of being rewritten afterwards.
+        held: List[Union[bytes, memoryview]] = []
+        # Length of the provisional header, once one has been written
+        written_lfh_len: Optional[int] = None
+        future_data: Union[bytes, memoryview] = b""
 
         for f in item.compressed_data_futures:
             # TODO this exception-setting thing doesn't appear to work, and
@@ -443,59 +549,91 @@ class WZip:
             try:
                 (future_data, future_size, future_crc) = f.result()
             except Exception as e:
-                self._exit_stack(item.exit_stack)
                 self._exc = e
                 traceback.print_exc()
+                # Later blocks may still be reading the file's data, which can
+                # be a pooled buffer that closing hands to the next file; and
+                # like below, nothing may still refer to it when it's closed.
+                wait(item.compressed_data_futures)
+                item.compressed_data_futures = ()
+                held.clear()
+                future_data = b""
+                self._io_executor.submit(self._close_file, item.wrapped_file)
                 return
 
-            with kev("write", size=len(future_data) if future_data is not None else 0):
-                if future_data:
-                    self._fobj.write(future_data)
-                    self._bytes_written += len(future_data)
-                    running_size += len(future_data)
-            with kev("crc32_combine"):
-                if future_crc is not None:
-                    if running_crc is None:
-                        running_crc = future_crc
-                    else:
-                        running_crc = crc32_combine(
-                            running_crc, future_crc, future_size
+            if future_data:
+                running_size += len(future_data)
+                if written_lfh_len is not None:
+                    with kev("write", size=len(future_data)):
+                        self._fobj.write(future_data)
+                        self._bytes_written += len(future_data)
+                else:
+                    held.append(future_data)
+                    if running_size > MAX_HELD_BYTES:
+                        # Too big to hold; write a provisional header and
+                        # everything so far, then patch the header below.
+                        written_lfh, min_ver = item.partial_lfh.dump()
+                        self._central_directory_min_ver = max(
+                            self._central_directory_min_ver, min_ver
                         )
-
-        # XXX If there are any refereces lying around, the mmap.close() will
-        # raise, and right now nothing will ever see that exception.
-        item.compressed_data_futures = ()
-        del future_data
-        self._io_executor.submit(self._exit_stack, item.exit_stack)
+                        written_lfh_len = len(written_lfh)
+                        with kev("write", size=running_size):
+                            self._fobj.write(written_lfh)
+                            self._fobj.writelines(held)
+                        self._bytes_written += running_size
+                        del written_lfh
+                        held = []
+            if future_crc is not None:
+                crc_parts.append((future_crc, future_size))
 
         # assert buf
-        lfh = replace(item.partial_lfh, csize=running_size)
-        if running_crc is not None:
-            lfh = replace(lfh, crc32=running_crc)
-        t1 = time.time()
-
-        # This doesn't know the _relative_ offset until we actually start
-        # outputting the central directory, so just defer all choices
-        # until then.
-        self._central_directory.append((pos, lfh))
+        lfh = item.partial_lfh
+        lfh.csize = running_size
+        if crc_parts:
+            with kev("crc32_combine"):
+                lfh.crc32 = crc32_combine_many(crc_parts)
+        t1 = time.monotonic() if log_timing else 0.0
+
+        self._add_to_central_directory(pos, lfh)
         new_lfh, min_ver = lfh.dump()
         self._central_directory_min_ver = max(self._central_directory_min_ver, min_ver)
-        if len(new_lfh) != len(written_lfh):
-            raise ValueError("lfh changed size")
-        t = self._fobj.tell()
-        self._fobj.seek(pos)
-        self._fobj.write(new_lfh)
-        # TODO the seek is probably more costly than the write here :/
+        if written_lfh_len is None:
+            with kev("write", size=len(new_lfh) + running_size):
+                self._fobj.write(new_lfh)
+                self._fobj.writelines(held)
+            self._bytes_written += running_size
+            held = []
+        else:
+            if len(new_lfh) != written_lfh_len:
+                raise ValueError("lfh changed size")
+            with kev("rewrite lfh"):
+                if self._use_pwrite:
+                    # The header may still be in the buffer
+                    self._fobj.flush()
+                    os.pwrite(self._fobj.fileno(), new_lfh, pos)
+                else:
+                    t = self._fobj.tell()
+                    self._fobj.seek(pos)
+                    self._fobj.write(new_lfh)
+                    self._fobj.seek(t)
         self._bytes_written += len(new_lfh)
-        self._fobj.seek(t)
-        t2 = time.time()
-        LOG.info(
-            "Done writing %s ratio=%.1f%% compwait=%.1fs write=%.1fs",
-            lfh.filename,
-            lfh.csize / lfh.usize * 100 if lfh.usize != 0 else 100 * lfh.csize,
-            t1 - t0,
-            t2 - t1,
-        )
+
+        # XXX If there are any refereces lying around, the mmap.close() will
+        # raise, and right now nothing will ever see that exception.
+        item.compressed_data_futures = ()
+        # The loop variable keeps the last future (and its result) alive too
+        del f, future_data
+        self._io_executor.submit(self._close_file, item.wrapped_file)
+
+        if log_timing:
+            t2 = time.monotonic()
+            LOG.info(
+                "Done writing %s ratio=%.1f%% compwait=%.1fs write=%.1fs",
+                lfh.filename,
+                lfh.csize / lfh.usize * 100 if lfh.usize != 0 else 100 * lfh.csize,
+                t1 - t0,
+                t2 - t1,
+            )
 
     def _open_consumer(self) -> None:
         while True:
@@ -513,15 +651,26 @@ class WZip:
                     except Exception as e:
                         self._exc = e
                         traceback.print_exc()
+                        # Nothing was opened, but write() took a slot for it
+                        self._file_budget.release()
                         continue
 
-                self.enqueue(partial_lfh, wf)
+                try:
+                    self.enqueue(partial_lfh, wf)
+                except Exception as e:
+                    # If this thread died, nothing would ever reach the consumer
+                    # (not even the shutdown sentinel) and __exit__ would hang.
+                    self._exc = e
+                    traceback.print_exc()
+                    self._io_executor.submit(self._close_file, wf)
+
+
+def identity(x: Union[memoryview, bytes]) -> CompressedChunk:
+    return CompressedChunk(x, 0, None)
 
 
-def identity(
-    x: Union[memoryview, bytes]
-) -> Tuple[Union[memoryview, bytes], int, Optional[int]]:
-    return (x, 0, None)
+def _read_precompressed(fd: int, n: int, offset: int) -> CompressedChunk:
+    return CompressedChunk(_preadn(fd, n, offset), 0, None)
 
 
 def binary_io_check(f: object) -> bool: